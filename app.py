@@ -1,14 +1,44 @@
 import streamlit as st
 import requests
+import os
+import re
+import math
+import hashlib
+import threading
+import sqlite3
+import uuid
+import zlib
 import json
 import time
 import datetime
-from typing import Optional, Dict, List
-import plotly.graph_objects as go
-import plotly.express as px
-import pandas as pd
-import base64
-import io
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Optional, Dict, List, Tuple
+from groq_client import (
+    GROQ_BASE_URL,
+    GENERATION_DEADLINE,
+    HEDGE_ENABLED,
+    Generation,
+    GroqAPIError,
+    get_http_session,
+    get_model_deadline,
+    get_model_info,
+    get_model_router,
+    get_pool_stats,
+    get_providers,
+    get_rate_limiters,
+    request_cache_key,
+    request_completion
+)
+import metrics
+from history import ChatMessage, MessageHistory, SessionMemoryRegistry, format_clock
+from retrieval import HashingEmbedder, IndexCache, VectorIndex
+from tracing import Trace, get_trace_exporter, span, use_trace
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
 # Set page config with enhanced settings
 st.set_page_config(
@@ -18,23 +48,21 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-def inject_css():
-    """Inject custom futuristic CSS styling"""
-    st.markdown("""
+APP_CSS = """
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Orbitron:wght@400;700;900&family=Rajdhani:wght@300;400;500;600;700&display=swap');
-    
+
     /* Global styling */
     .stApp {
         background: linear-gradient(135deg, #0c0c0c 0%, #1a1a2e 50%, #16213e 100%);
         font-family: 'Rajdhani', sans-serif;
     }
-    
+
     /* Hide Streamlit branding */
     #MainMenu {visibility: hidden;}
     footer {visibility: hidden;}
     header {visibility: hidden;}
-    
+
     /* Custom header */
     .main-header {
         background: linear-gradient(90deg, #00d4ff 0%, #7c3aed 50%, #f59e0b 100%);
@@ -46,7 +74,7 @@ def inject_css():
         text-align: center;
         box-shadow: 0 10px 30px rgba(0, 212, 255, 0.3);
     }
-    
+
     .main-header h1 {
         font-family: 'Orbitron', monospace;
         font-size: 3rem;
@@ -56,26 +84,26 @@ def inject_css():
         margin: 0;
         letter-spacing: 3px;
     }
-    
+
     .main-header p {
         color: rgba(255, 255, 255, 0.9);
         font-size: 1.2rem;
         margin-top: 0.5rem;
         font-weight: 300;
     }
-    
+
     @keyframes gradientShift {
         0% { background-position: 0% 50%; }
         50% { background-position: 100% 50%; }
         100% { background-position: 0% 50%; }
     }
-    
+
     /* Sidebar styling */
     .css-1d391kg {
         background: linear-gradient(180deg, #1a1a2e 0%, #16213e 100%);
         border-right: 2px solid #00d4ff;
     }
-    
+
     /* Chat messages */
     .stChatMessage {
         background: rgba(255, 255, 255, 0.05);
@@ -84,19 +112,19 @@ def inject_css():
         margin: 1rem 0;
         backdrop-filter: blur(10px);
     }
-    
+
     /* User message */
     .stChatMessage[data-testid="user-message"] {
         background: linear-gradient(135deg, rgba(124, 58, 237, 0.2) 0%, rgba(0, 212, 255, 0.2) 100%);
         border-color: #7c3aed;
     }
-    
+
     /* Assistant message */
     .stChatMessage[data-testid="assistant-message"] {
         background: linear-gradient(135deg, rgba(0, 212, 255, 0.2) 0%, rgba(245, 158, 11, 0.2) 100%);
         border-color: #00d4ff;
     }
-    
+
     /* Input field */
     .stTextInput > div > div > input {
         background: rgba(0, 0, 0, 0.6);
@@ -106,12 +134,12 @@ def inject_css():
         font-family: 'Rajdhani', sans-serif;
         font-size: 1.1rem;
     }
-    
+
     .stTextInput > div > div > input:focus {
         border-color: #7c3aed;
         box-shadow: 0 0 15px rgba(124, 58, 237, 0.5);
     }
-    
+
     /* Buttons */
     .stButton > button {
         background: linear-gradient(45deg, #00d4ff, #7c3aed);
@@ -125,24 +153,24 @@ def inject_css():
         transition: all 0.3s ease;
         box-shadow: 0 5px 15px rgba(0, 212, 255, 0.3);
     }
-    
+
     .stButton > button:hover {
         transform: translateY(-2px);
         box-shadow: 0 10px 25px rgba(124, 58, 237, 0.4);
     }
-    
+
     /* Selectbox */
     .stSelectbox > div > div {
         background: rgba(0, 0, 0, 0.6);
         border: 2px solid #00d4ff;
         border-radius: 10px;
     }
-    
+
     /* Slider */
     .stSlider > div > div > div {
         background: linear-gradient(90deg, #00d4ff, #7c3aed);
     }
-    
+
     /* Metrics */
     .metric-card {
         background: linear-gradient(135deg, rgba(0, 212, 255, 0.1) 0%, rgba(124, 58, 237, 0.1) 100%);
@@ -152,7 +180,7 @@ def inject_css():
         margin: 0.5rem 0;
         backdrop-filter: blur(10px);
     }
-    
+
     /* Stats panel */
     .stats-panel {
         background: linear-gradient(135deg, rgba(0, 0, 0, 0.8) 0%, rgba(26, 26, 46, 0.8) 100%);
@@ -162,7 +190,7 @@ def inject_css():
         margin: 1rem 0;
         backdrop-filter: blur(15px);
     }
-    
+
     /* Custom text colors */
     .cyber-text {
         color: #00d4ff;
@@ -170,17 +198,17 @@ def inject_css():
         font-weight: 700;
         text-shadow: 0 0 10px rgba(0, 212, 255, 0.5);
     }
-    
+
     .warning-text {
         color: #f59e0b;
         font-weight: 600;
     }
-    
+
     .success-text {
         color: #10b981;
         font-weight: 600;
     }
-    
+
     /* Animated loading */
     .loading-animation {
         display: inline-block;
@@ -191,11 +219,11 @@ def inject_css():
         border-top-color: #00d4ff;
         animation: spin 1s ease-in-out infinite;
     }
-    
+
     @keyframes spin {
         to { transform: rotate(360deg); }
     }
-    
+
     /* Glassmorphism effect */
     .glass-panel {
         background: rgba(255, 255, 255, 0.05);
@@ -205,7 +233,7 @@ def inject_css():
         padding: 1.5rem;
         margin: 1rem 0;
     }
-    
+
     /* Typing indicator */
     .typing-indicator {
         display: flex;
@@ -213,7 +241,7 @@ def inject_css():
         gap: 5px;
         padding: 10px;
     }
-    
+
     .typing-dot {
         width: 8px;
         height: 8px;
@@ -221,145 +249,1368 @@ def inject_css():
         background: #00d4ff;
         animation: typing 1.4s infinite ease-in-out;
     }
-    
+
     .typing-dot:nth-child(1) { animation-delay: -0.32s; }
     .typing-dot:nth-child(2) { animation-delay: -0.16s; }
-    
+
     @keyframes typing {
         0%, 80%, 100% { transform: scale(0); opacity: 0.5; }
         40% { transform: scale(1); opacity: 1; }
     }
     </style>
-    """, unsafe_allow_html=True)
+"""
+
+HEADER_HTML = """
+    <div class="main-header">
+        <h1>🚀 AI NEURAL INTERFACE</h1>
+        <p>Advanced Multi-Model AI Communication Platform</p>
+    </div>
+    """
+
+FOOTER_HTML = """
+    <div style='text-align: center; color: #00d4ff; font-family: Orbitron, monospace;'>
+        <h4>🚀 AI Neural Interface v2.0</h4>
+        <p style='color: rgba(255,255,255,0.7);'>
+            Powered by Groq API • Enhanced Neural Architecture • Built with Streamlit
+        </p>
+        <p style='color: rgba(0,212,255,0.8); font-size: 0.9rem;'>
+            🔬 Advanced AI Communication Platform • 🌐 Multi-Model Support • 📊 Real-time Analytics
+        </p>
+    </div>
+    """
+
+def _minify_css(css: str) -> str:
+    """Strip comments and insignificant whitespace from a stylesheet"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};,>])\s*", r"\1", css).strip()
+
+def _minify_html(html: str) -> str:
+    """Collapse indentation and newlines in a static HTML snippet"""
+    return re.sub(r">\s+<", "><", " ".join(line.strip() for line in html.strip().splitlines()))
+
+@st.cache_resource
+def get_static_assets() -> Dict[str, str]:
+    """Static CSS and HTML, minified once per process rather than rebuilt every rerun"""
+    return {
+        "css": _minify_css(APP_CSS),
+        "header": _minify_html(HEADER_HTML),
+        "footer": _minify_html(FOOTER_HTML)
+    }
+
+def inject_css():
+    """Inject custom futuristic CSS styling"""
+    st.markdown(get_static_assets()["css"], unsafe_allow_html=True)
+
+# Samples kept for percentile estimates; mean/variance cover every sample
+STATS_WINDOW = 512
+
+class RollingStats:
+    """Bounded streaming summary of a metric: a recent-sample window for percentiles plus a running mean and variance"""
+
+    __slots__ = ("window", "count", "mean", "_m2")
+
+    def __init__(self, size: int = STATS_WINDOW):
+        self.window = deque(maxlen=size)
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.window.append(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def stdev(self) -> float:
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def percentiles(self, *quantiles: float) -> List[Optional[float]]:
+        """Nearest-rank percentiles (0-100) over the recent window"""
+        if not self.window:
+            return [None] * len(quantiles)
+        ordered = sorted(self.window)
+        last = len(ordered) - 1
+        return [ordered[min(last, max(0, math.ceil(q / 100 * len(ordered)) - 1))] for q in quantiles]
+
+    def to_dict(self) -> Dict:
+        p50, p95, p99 = self.percentiles(50, 95, 99)
+        return {"count": self.count, "mean": self.mean, "stdev": self.stdev, "p50": p50, "p95": p95, "p99": p99}
+
+class RequestLog:
+    """Append-only columnar log of completed requests, one NumPy array per column"""
+
+    _COLUMNS = {
+        "timestamp": "float64",
+        "latency": "float64",
+        "ttft": "float64",
+        "prompt_tokens": "int32",
+        "completion_tokens": "int32",
+        "model": "int16"
+    }
+
+    def __init__(self, capacity: int = 64):
+        self.size = 0
+        self.models: List[str] = []
+        self._model_codes: Dict[str, int] = {}
+        self._capacity = capacity
+        # Allocated on the first append, so NumPy is only loaded once a request completes
+        self._columns = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, model: str, latency: float, ttft: Optional[float] = None,
+               prompt_tokens: int = 0, completion_tokens: int = 0):
+        import numpy as np
+
+        if self._columns is None:
+            self._columns = {name: np.empty(self._capacity, dtype=dtype) for name, dtype in self._COLUMNS.items()}
+        elif self.size == len(self._columns["timestamp"]):
+            for name, column in self._columns.items():
+                grown = np.empty(len(column) * 2, dtype=column.dtype)
+                grown[:self.size] = column
+                self._columns[name] = grown
+
+        code = self._model_codes.get(model)
+        if code is None:
+            code = self._model_codes[model] = len(self.models)
+            self.models.append(model)
+
+        row = self.size
+        self._columns["timestamp"][row] = time.time()
+        self._columns["latency"][row] = latency
+        self._columns["ttft"][row] = np.nan if ttft is None else ttft
+        self._columns["prompt_tokens"][row] = prompt_tokens
+        self._columns["completion_tokens"][row] = completion_tokens
+        self._columns["model"][row] = code
+        self.size += 1
+
+    @property
+    def nbytes(self) -> int:
+        if self._columns is None:
+            return 0
+        return sum(column.nbytes for column in self._columns.values())
+
+    def column(self, name: str) -> "np.ndarray":
+        """View of the filled part of a column"""
+        import numpy as np
+
+        if self._columns is None:
+            return np.empty(0, dtype=self._COLUMNS[name])
+        return self._columns[name][:self.size]
+
+    def to_frame(self, last: Optional[int] = None) -> "pd.DataFrame":
+        import pandas as pd
+
+        start = max(self.size - last, 0) if last else 0
+        frame = pd.DataFrame({name: self.column(name)[start:] for name in self._COLUMNS})
+        frame["timestamp"] = pd.to_datetime(frame["timestamp"], unit="s")
+        frame["model"] = pd.Categorical.from_codes(frame["model"], categories=self.models)
+        return frame
+
+    def to_dict(self) -> Dict[str, List]:
+        columns = {name: self.column(name).tolist() for name in self._COLUMNS}
+        # NaN marks a request without a first-token time; JSON has no NaN, so export null
+        columns["ttft"] = [None if math.isnan(ttft) else ttft for ttft in columns["ttft"]]
+        columns["model"] = [self.models[code] for code in columns["model"]]
+        return columns
+
+def new_chat_stats():
+    """Create a fresh stats dictionary for a chat session"""
+    return {
+        "total_messages": 0,
+        "total_tokens": 0,
+        "session_start": datetime.datetime.now(),
+        "models_used": set(),
+        "latency": RollingStats(),
+        "ttft": RollingStats(),
+        "throughput": RollingStats(),
+        "request_log": RequestLog(),
+        "cache_hits": 0,
+        "cache_misses": 0
+    }
 
 def initialize_session_state():
     """Initialize all session state variables"""
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    if not isinstance(st.session_state.get("messages"), MessageHistory):
+        # Also adopts a plain list seeded from outside (tests, benchmarks)
+        st.session_state.messages = MessageHistory(st.session_state.get("messages", []))
     if "chat_stats" not in st.session_state:
-        st.session_state.chat_stats = {
-            "total_messages": 0,
-            "total_tokens": 0,
-            "session_start": datetime.datetime.now(),
-            "models_used": set(),
-            "average_response_time": 0,
-            "response_times": []
-        }
+        st.session_state.chat_stats = new_chat_stats()
+    if "session_owner" not in st.session_state:
+        # Set from the API key once the sidebar has read it (sync_session_owner)
+        st.session_state.session_owner = None
     if "chat_sessions" not in st.session_state:
-        st.session_state.chat_sessions = {}
+        refresh_session_list()
     if "current_session" not in st.session_state:
-        st.session_state.current_session = "default"
+        # None until the first message creates a stored session
+        st.session_state.current_session = None
+    if "history_has_more" not in st.session_state:
+        st.session_state.history_has_more = False
+    if "history_window" not in st.session_state:
+        st.session_state.history_window = HISTORY_WINDOW
     if "theme_mode" not in st.session_state:
         st.session_state.theme_mode = "cyber"
+    if "base_url" not in st.session_state:
+        st.session_state.base_url = GROQ_BASE_URL
+    if "traces" not in st.session_state:
+        st.session_state.traces = deque(maxlen=TRACE_PANEL_SIZE)
+    if "client_id" not in st.session_state:
+        # Fair-queuing identity of this browser session in the shared rate limiter
+        st.session_state.client_id = uuid.uuid4().hex
+        metrics.SESSIONS_STARTED.inc()
+    # Re-registered every run, since switching conversations replaces the history
+    get_memory_registry().register(st.session_state.client_id, st.session_state.messages)
+    if "search_target" not in st.session_state:
+        # seq of the turn the last search jump landed on, highlighted in the history
+        st.session_state.search_target = None
+    if "generation" not in st.session_state:
+        # Reply being generated in the background, see start_generation
+        st.session_state.generation = None
 
-def get_model_info():
-    """Extended model information with pricing and capabilities"""
-    return {
-        "Llama 3 70B": {
-            "id": "llama3-70b-8192",
-            "description": "Meta's most capable Llama 3 model",
-            "context": "8K tokens",
-            "price": "Free",
-            "category": "Premium"
-        },
-        "Llama 3 8B": {
-            "id": "llama3-8b-8192",
-            "description": "Fast and efficient Llama 3 model",
-            "context": "8K tokens",
-            "price": "Free",
-            "category": "Standard"
-        },
-        "Mixtral 8x7B": {
-            "id": "mixtral-8x7b-32768",
-            "description": "High-quality mixture of experts model",
-            "context": "32K tokens",
-            "price": "Free",
-            "category": "Premium"
-        },
-        "Gemma 7B": {
-            "id": "gemma-7b-it",
-            "description": "Google's lightweight model",
-            "context": "8K tokens",
-            "price": "Free",
-            "category": "Economy"
-        }
-    }
+# Optional local BPE vocabulary in tiktoken format (Llama 3's tokenizer.model is one)
+TOKENIZER_VOCAB_PATH = os.environ.get("TOKENIZER_VOCAB_PATH", "")
+TOKEN_CACHE_SIZE = 50000
 
-def estimate_tokens(text: str) -> int:
-    """Rough token estimation"""
-    return len(text.split()) * 1.3
+# Llama 3 pre-tokenizer split pattern, used with the local BPE vocabulary
+LLAMA3_SPLIT_PATTERN = (
+    r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}"
+    r"| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+)
 
-def get_groq_response(messages, model="llama3-70b-8192", temperature=0.7, max_tokens=1000):
-    """Enhanced API call with better error handling and stats tracking"""
-    start_time = time.time()
-    
+# Approximation of the same split for when no vocabulary is available
+_PRETOKEN_PATTERN = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+",
+    re.IGNORECASE
+)
+
+def _load_bpe_encoding(vocab_path: str):
+    """Build a tiktoken encoder from a local vocabulary file, or None if unavailable"""
+    if not vocab_path or not os.path.exists(vocab_path):
+        return None
     try:
-        if "api_key" not in st.session_state or not st.session_state.api_key:
-            st.error("🔐 **Neural Link Disconnected** - Please establish API connection in the sidebar.")
+        import tiktoken
+        from tiktoken.load import load_tiktoken_bpe
+    except ImportError:
+        return None
+    return tiktoken.Encoding(
+        name=os.path.basename(vocab_path),
+        pat_str=LLAMA3_SPLIT_PATTERN,
+        mergeable_ranks=load_tiktoken_bpe(vocab_path),
+        special_tokens={}
+    )
+
+def _heuristic_token_count(text: str) -> int:
+    """Offline estimate from the BPE pre-tokenizer split: short words are one token, long pieces several"""
+    count = 0
+    for piece in _PRETOKEN_PATTERN.findall(text):
+        if piece.isascii():
+            count += 1 if len(piece) <= 7 else math.ceil(len(piece) / 5)
+        else:
+            count += math.ceil(len(piece.encode("utf-8")) / 3)
+    return count
+
+class TokenCounter:
+    """Offline token counter memoized by content hash and calibrated against reported usage"""
+
+    def __init__(self, vocab_path: str = "", max_entries: int = TOKEN_CACHE_SIZE):
+        self._encoding = _load_bpe_encoding(vocab_path)
+        self._cache = OrderedDict()
+        self._max_entries = max_entries
+        self._calibration = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self) -> str:
+        return "bpe" if self._encoding is not None else "heuristic"
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _store(self, key: bytes, count: int):
+        with self._lock:
+            self._cache[key] = count
+            self._cache.move_to_end(key)
+            if len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text; each distinct content is only tokenized once"""
+        key = self._key(text)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        if self._encoding is not None:
+            count = len(self._encoding.encode_ordinary(text))
+        else:
+            count = _heuristic_token_count(text)
+        self._store(key, count)
+        return count
+
+    def remember(self, text: str, count: int):
+        """Record an exact count reported by the API for this content"""
+        self._store(self._key(text), count)
+
+    def reconcile(self, model: str, estimated_prompt_tokens: int, actual_prompt_tokens: Optional[int]):
+        """Fold the API's prompt token count into the model's calibration ratio"""
+        if not estimated_prompt_tokens or not actual_prompt_tokens:
+            return
+        ratio = actual_prompt_tokens / estimated_prompt_tokens
+        with self._lock:
+            previous = self._calibration.get(model)
+            # EWMA so one odd prompt doesn't swing the budget
+            self._calibration[model] = ratio if previous is None else 0.8 * previous + 0.2 * ratio
+
+    def calibration(self, model: str) -> float:
+        """Multiplier from our estimate to the model's real token count"""
+        with self._lock:
+            return self._calibration.get(model, 1.0)
+
+@st.cache_resource
+def get_token_counter() -> TokenCounter:
+    """Process-wide token counter so the cache survives reruns and is shared by sessions"""
+    return TokenCounter(TOKENIZER_VOCAB_PATH)
+
+def estimate_tokens(text: str) -> int:
+    """Token count for text (cached per content hash)"""
+    return get_token_counter().count(text)
+
+# Chat templates add a few tokens of role/formatting framing per message
+MESSAGE_OVERHEAD_TOKENS = 4
+CONTEXT_SAFETY_MARGIN = 64
+CONDENSED_SHARE = 0.1  # fraction of the prompt budget a condensed digest may use
+
+def message_tokens(message: Dict) -> int:
+    """Token cost of a chat message, including template framing"""
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+def _condense_messages(messages: List[Dict], budget: int) -> Optional[str]:
+    """Extractive digest of dropped turns: the opening line of each, newest first, within budget"""
+    header = "Earlier conversation (condensed):"
+    used = estimate_tokens(header) + MESSAGE_OVERHEAD_TOKENS
+    lines = []
+    for message in reversed(messages):
+        first_line = message["content"].strip().split("\n", 1)[0][:200]
+        if not first_line:
+            continue
+        line = f"- {message['role']}: {first_line}"
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return None
+    lines.reverse()
+    return "\n".join([header] + lines)
+
+def build_context_window(messages: List[Dict], context_limit: int, max_tokens: int,
+                         condense_older: bool = False, calibration: float = 1.0,
+                         max_messages: Optional[int] = None) -> Tuple[List[Dict], Dict]:
+    """Pack the newest messages that fit the context window; returns the API messages and a summary"""
+    budget = context_limit - max_tokens - CONTEXT_SAFETY_MARGIN
+    selected = []
+    used = 0
+    for message in reversed(messages):
+        cost = math.ceil(message_tokens(message) * calibration)
+        if selected and (used + cost > budget or len(selected) == max_messages):
+            break
+        selected.append(message)
+        used += cost
+    selected.reverse()
+
+    dropped = len(messages) - len(selected)
+    api_messages = [{"role": m["role"], "content": m["content"]} for m in selected]
+
+    if dropped and condense_older:
+        digest_budget = min(budget - used, int(budget * CONDENSED_SHARE))
+        digest = _condense_messages(messages[:dropped], int(digest_budget / calibration))
+        if digest:
+            api_messages.insert(0, {"role": "system", "content": digest})
+            used += math.ceil((estimate_tokens(digest) + MESSAGE_OVERHEAD_TOKENS) * calibration)
+
+    return api_messages, {
+        "included": len(selected),
+        "dropped": dropped,
+        "tokens": used,
+        "budget": budget
+    }
+
+# Recall: older turns most similar to the prompt, from a local vector index of the whole conversation
+RECALL_RECENT_MESSAGES = int(os.environ.get("RECALL_RECENT_MESSAGES", "12"))
+RECALL_TOP_K = int(os.environ.get("RECALL_TOP_K", "4"))
+RECALL_DIMENSIONS = int(os.environ.get("RECALL_DIMENSIONS", "256"))
+RECALL_MIN_SCORE = 0.15  # cosine similarity below which a turn is unrelated noise
+RECALL_SHARE = 0.2  # fraction of the prompt budget recalled turns may use
+RECALL_MESSAGE_CHARS = 1200
+
+@st.cache_resource
+def get_embedder() -> HashingEmbedder:
+    return HashingEmbedder(RECALL_DIMENSIONS)
+
+@st.cache_resource
+def get_recall_indexes() -> IndexCache:
+    """Process-wide, so tabs on the same conversation share one index"""
+    return IndexCache()
+
+def load_recall_index(session_id: str) -> VectorIndex:
+    """A conversation's vectors from the store, embedding and saving any it doesn't have yet"""
+    import numpy as np
+
+    store = get_session_store()
+    embedder = get_embedder()
+    stored = store.load_vectors(session_id, embedder.name)
+    missing = store.unembedded_messages(session_id, embedder.name)
+    if missing:
+        vectors = embedder.embed_many([content for _, content in missing])
+        added = [(seq, vector.tobytes()) for (seq, _), vector in zip(missing, vectors)]
+        store.save_vectors(session_id, embedder.name, added)
+        stored = sorted(stored + added)
+    index = VectorIndex(embedder.dimensions, max(len(stored), 256))
+    if stored:
+        index.add(
+            [seq for seq, _ in stored],
+            np.frombuffer(b"".join(vector for _, vector in stored), dtype=np.float32).reshape(len(stored), -1)
+        )
+    return index
+
+def recall_turns(session_id: str, query: str, before_seq: int, budget: int, calibration: float = 1.0) -> Tuple[Optional[str], int]:
+    """Older turns most similar to query, with their other halves, as one system message within budget"""
+    index = get_recall_indexes().get(session_id, lambda: load_recall_index(session_id))
+    hits = index.search(get_embedder().embed(query), RECALL_TOP_K, before_seq, RECALL_MIN_SCORE)
+    if not hits:
+        return None, 0
+    wanted = {seq + offset for seq, _ in hits for offset in (-1, 0, 1) if 0 <= seq + offset < before_seq}
+    found = get_session_store().get_messages(session_id, sorted(wanted))
+
+    header = "Relevant earlier conversation (recalled from before the recent turns):"
+    used = math.ceil((estimate_tokens(header) + MESSAGE_OVERHEAD_TOKENS) * calibration)
+    chosen: Dict[int, str] = {}
+    for seq, _ in hits:
+        message = found.get(seq)
+        if message is None or seq in chosen:
+            continue
+        partner = found.get(seq + 1 if message["role"] == "user" else seq - 1)
+        turn = [message] + ([partner] if partner is not None and partner["role"] != message["role"] else [])
+        lines = {}
+        for part in turn:
+            content = part["content"].strip()
+            if len(content) > RECALL_MESSAGE_CHARS:
+                content = content[:RECALL_MESSAGE_CHARS] + "…"
+            lines[part["seq"]] = f"- {part['role']} (#{part['seq'] + 1}): {content}"
+        cost = sum(math.ceil((estimate_tokens(line) + 1) * calibration)
+                   for seq_key, line in lines.items() if seq_key not in chosen)
+        if used + cost > budget:
+            continue
+        chosen.update(lines)
+        used += cost
+    if not chosen:
+        return None, 0
+    return "\n".join([header] + [chosen[seq] for seq in sorted(chosen)]), len(chosen)
+
+def add_recalled_turns(api_messages: List[Dict], context_info: Dict, messages: List[Dict],
+                       session_id: str, calibration: float = 1.0):
+    """Put recalled older turns ahead of the packed recent window, updating context_info"""
+    first_sent = messages[len(messages) - context_info["included"]].get("seq")
+    if not first_sent:
+        return  # the whole conversation is already in the window
+    budget = min(context_info["budget"] - context_info["tokens"], int(context_info["budget"] * RECALL_SHARE))
+    recalled, count = recall_turns(session_id, messages[-1]["content"], first_sent, budget, calibration)
+    if recalled is None:
+        return
+    # After a condensed digest, if any, so the recalled detail sits closest to the recent turns
+    position = 1 if api_messages and api_messages[0]["role"] == "system" and context_info["dropped"] else 0
+    api_messages.insert(position, {"role": "system", "content": recalled})
+    context_info["recalled"] = count
+    context_info["tokens"] += math.ceil((estimate_tokens(recalled) + MESSAGE_OVERHEAD_TOKENS) * calibration)
+
+# Response cache: in-memory LRU with TTL, plus an optional SQLite file that survives restarts
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_DB = os.environ.get("RESPONSE_CACHE_DB", "")
+
+class ResponseCache:
+    """Two-tier completion cache: an in-memory LRU in front of an optional SQLite table"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 db_path: str = ""):
+        self._memory = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self._ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self._ttl:
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
             return None
-            
-        api_key = st.session_state.api_key
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-        
-        data = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "stream": False
-        }
-        
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=60
+
+    def put(self, key: str, value: Dict):
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), created)
+                )
+                self._db.execute("DELETE FROM response_cache WHERE created < ?", (created - self._ttl,))
+                self._db.commit()
+
+    def _remember(self, key: str, created: float, value: Dict):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses
+            }
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache shared by every session"""
+    return ResponseCache(db_path=RESPONSE_CACHE_DB)
+
+def _record_cache_lookup(hit: bool):
+    """Count a cache lookup in the session stats and the process-wide metrics"""
+    st.session_state.chat_stats["cache_hits" if hit else "cache_misses"] += 1
+    metrics.CACHE_LOOKUPS.inc(result="hit" if hit else "miss")
+
+def _format_seconds(value: Optional[float]) -> str:
+    return f"{value:.2f}s" if value is not None else "–"
+
+def render_server_metrics():
+    """Process-wide totals across every session, unlike the per-tab stats dashboard"""
+    summary = metrics.summary()
+    st.markdown(f"""
+    ⚡ **QPS (1 min)**: {summary['qps']:.2f}
+    📨 **Requests**: {summary['requests']:,.0f} ({summary['errors']:,.0f} failed)
+    🔥 **Tokens**: {summary['tokens']:,.0f}
+    🛫 **In flight**: {summary['in_flight']:,.0f}
+    🛑 **429s absorbed**: {summary['throttled']:,.0f}
+    🔁 **Deduplicated**: {summary['deduplicated']:,.0f}
+    ⏹️ **Stopped**: {summary['stopped']:,.0f}
+    🪁 **Hedges**: {summary['hedges'].get('fired', 0):,.0f} fired, {summary['hedges'].get('won', 0):,.0f} won, {summary['hedges'].get('denied', 0):,.0f} over budget
+    👥 **Sessions started**: {summary['sessions']:,.0f}
+    """)
+    for model, entry in sorted(summary["models"].items()):
+        st.caption(
+            f"🧠 {model}: {entry['requests']:,.0f} req | p50 {_format_seconds(entry['p50'])} | "
+            f"p95 {_format_seconds(entry['p95'])} | p99 {_format_seconds(entry['p99'])}"
         )
-        
-        response_time = time.time() - start_time
-        
-        if response.status_code == 200:
-            result = response.json()
-            content = result["choices"][0]["message"]["content"]
-            
-            # Update stats
-            st.session_state.chat_stats["response_times"].append(response_time)
-            st.session_state.chat_stats["average_response_time"] = sum(st.session_state.chat_stats["response_times"]) / len(st.session_state.chat_stats["response_times"])
-            st.session_state.chat_stats["models_used"].add(model)
-            
-            if "usage" in result:
-                st.session_state.chat_stats["total_tokens"] += result["usage"].get("total_tokens", 0)
-            
-            return content
+    if metrics.METRICS_PORT:
+        st.caption(f"📡 Prometheus: http://<host>:{metrics.METRICS_PORT}/metrics")
+
+def _show_api_error(error: GroqAPIError):
+    """Surface an API error in the UI"""
+    st.error(f"🔴 **Neural Network Error {error.status_code}**\n```{error.detail}```")
+
+def _account_tokens(model: str, messages: List[Dict], content: str, usage: Optional[Dict]) -> Tuple[int, int]:
+    """(prompt, completion) tokens used by one turn, from reported usage or the local count"""
+    counter = get_token_counter()
+    prompt_estimate = sum(message_tokens(m) for m in messages)
+    if usage and usage.get("total_tokens"):
+        counter.reconcile(model, prompt_estimate, usage.get("prompt_tokens"))
+        if usage.get("completion_tokens"):
+            counter.remember(content, usage["completion_tokens"])
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        return prompt_tokens, usage["total_tokens"] - prompt_tokens
+    return prompt_estimate, counter.count(content)
+
+def _record_response_stats(model: str, response_time: float, tokens: Tuple[int, int] = (0, 0),
+                           ttft: Optional[float] = None, tokens_per_second: Optional[float] = None):
+    """Update session stats after a completion, including one cut short"""
+    stats = st.session_state.chat_stats
+    stats["latency"].add(response_time)
+    stats["models_used"].add(model)
+    stats["total_tokens"] += sum(tokens)
+    stats["request_log"].append(model, response_time, ttft, *tokens)
+
+    if ttft is not None:
+        stats["ttft"].add(ttft)
+    if tokens_per_second is not None:
+        stats["throughput"].add(tokens_per_second)
+
+# Bearer token sent to providers that don't check keys, such as the local mock
+KEYLESS_API_KEY = "local"
+
+GENERATION_POLL_INTERVAL = 0.05
+# Longest gap between redraws while waiting; each redraw is also where Streamlit
+# notices a Stop click, so this bounds how long the click takes to land
+GENERATION_HEARTBEAT = 0.25
+
+def _typing_indicator(elapsed: float) -> str:
+    return f"""
+    <div class="typing-indicator">
+        <span>🤖 AI is processing · {elapsed:.0f}s</span>
+        <div class="typing-dot"></div>
+        <div class="typing-dot"></div>
+        <div class="typing-dot"></div>
+    </div>
+    """
+
+def _show_request_error(error: Exception):
+    """Surface a failed request in the UI"""
+    if isinstance(error, GroqAPIError):
+        _show_api_error(error)
+    elif isinstance(error, requests.exceptions.Timeout):
+        st.error("⏱️ **Connection Timeout** - The AI is taking too long to respond. Try again.")
+    elif isinstance(error, requests.exceptions.RequestException):
+        st.error(f"🌐 **Network Disruption**: {str(error)}")
+    else:
+        st.error(f"⚠️ **System Anomaly**: {str(error)}")
+
+AUTO_MODEL = "🤖 Auto"
+
+def route_models(model_info: Dict, messages, max_tokens: int) -> List[str]:
+    """Model names for an Auto turn, best first: fastest healthy model that fits the whole history"""
+    required = sum(message_tokens(m) for m in messages) + max_tokens + CONTEXT_SAFETY_MARGIN
+    names = {info["id"]: name for name, info in model_info.items()}
+    ranked = get_model_router().rank({info["id"]: info["context_tokens"] for info in model_info.values()}, required)
+    return [names[model_id] for model_id in ranked]
+
+def render_router_stats(model_info: Dict):
+    """Live latency and health per model, as the Auto router sees them"""
+    stats = get_model_router().stats()
+    lines = []
+    for name, info in model_info.items():
+        entry = stats.get(info["id"])
+        if entry is None or (entry["latency"] is None and entry["healthy"]):
+            lines.append(f"⚪ **{name}**: no samples yet")
+            continue
+        line = f"{'🟢' if entry['healthy'] else '🔴'} **{name}**: "
+        if entry["latency"] is not None:
+            line += f"~{entry['latency']:.2f}s (tail {entry['tail']:.2f}s) · "
+        line += f"{entry['error_rate']:.0%} errors · {entry['samples']} samples"
+        if entry["cooldown"] > 0:
+            line += f" · benched {entry['cooldown']:.0f}s after {entry['last_status']}"
+        lines.append(line)
+    st.markdown("  \n".join(lines))
+
+def start_generation(messages, model_name: str, model_id: str, temperature: float, max_tokens: int,
+                     use_cache: bool, stream: bool, deadline: float, context_info: Dict, trace: Trace,
+                     fallbacks: Optional[Dict[str, str]] = None, auto: bool = False, hedge: bool = False):
+    """Start the assistant's reply on a background thread and keep it in session state"""
+    fallbacks = fallbacks or {}
+    turn = {
+        "id": uuid.uuid4().hex[:12],
+        "generation": None,
+        "cached": None,
+        "model_name": model_name,
+        "model_id": model_id,
+        "auto": auto,
+        "model_names": {model_id: model_name, **{fallback_id: name for name, fallback_id in fallbacks.items()}},
+        "messages": messages,
+        "stream": stream,
+        "deadline": deadline,
+        "context_info": context_info,
+        "cache_key": None,
+        "trace": trace,
+        "render_time": 0.0,
+        "render_updates": 0
+    }
+    if use_cache:
+        turn["cache_key"] = request_cache_key(model_id, messages, temperature, max_tokens, st.session_state.base_url)
+        with span("cache") as cache_span:
+            cached = get_response_cache().get(turn["cache_key"])
+            cache_span.set(hit=cached is not None)
+        _record_cache_lookup(cached is not None)
+        if cached is not None:
+            turn["cached"] = cached["content"]
+    if turn["cached"] is None:
+        turn["generation"] = Generation(
+            st.session_state.api_key, messages, model_id, temperature, max_tokens,
+            stream=stream,
+            deadline=deadline,
+            session=get_http_session(retry_status=not fallbacks),
+            client=st.session_state.client_id,
+            base_url=st.session_state.base_url,
+            fallbacks=list(fallbacks.values()),
+            hedge=hedge
+        )
+    st.session_state.generation = turn
+
+def stop_generation():
+    """Cancel and forget the active reply, e.g. when leaving its conversation"""
+    turn = st.session_state.get("generation")
+    if turn is None:
+        return
+    if turn["generation"] is not None:
+        turn["generation"].cancel()
+    turn["trace"].finish()
+    st.session_state.generation = None
+
+def render_generation():
+    """Render the reply being generated, with a Stop button, until it settles"""
+    turn = st.session_state.generation
+    generation = turn["generation"]
+    with st.chat_message("assistant"):
+        stop_slot = st.empty()
+        placeholder = st.empty()
+        if generation is not None and not generation.done.is_set():
+            # Keyed per turn: a prompt sent mid-reply renders the old turn and the new one in the same run
+            if stop_slot.button("⏹️ Stop generating", key=f"stop_generation_{turn['id']}"):
+                generation.cancel()
+
+        with use_trace(turn["trace"]):
+            if generation is not None:
+                rendered = None
+                last_render = 0.0
+                while not generation.done.wait(GENERATION_POLL_INTERVAL):
+                    text = generation.text if turn["stream"] else ""
+                    if text == rendered and time.time() - last_render < GENERATION_HEARTBEAT:
+                        continue
+                    render_start = time.perf_counter()
+                    if text:
+                        placeholder.markdown(text + "▌")
+                    else:
+                        placeholder.markdown(_typing_indicator(generation.elapsed), unsafe_allow_html=True)
+                    turn["render_time"] += time.perf_counter() - render_start
+                    turn["render_updates"] += 1
+                    rendered = text
+                    last_render = time.time()
+            stop_slot.empty()
+            finish_generation(turn, placeholder)
+
+def finish_generation(turn: Dict, placeholder):
+    """Show and store a settled reply, record its stats and close its trace"""
+    generation = turn["generation"]
+    trace = turn["trace"]
+    status = generation.status if generation is not None else "ok"
+    content = generation.text if generation is not None else turn["cached"]
+    # The model that answered, which differs from the first choice after a fallback
+    model_id = generation.model if generation is not None else turn["model_id"]
+
+    render_start = time.perf_counter()
+    if content:
+        placeholder.markdown(content)
+    else:
+        placeholder.empty()
+    # Redraws are spread over the stream (and reruns), so they are recorded as one summed span
+    trace.add_span("render", turn["render_time"] + time.perf_counter() - render_start,
+                   updates=turn["render_updates"] + 1)
+
+    if status == "ok" and generation is not None:
+        result = generation.result
+        tokens = _account_tokens(model_id, turn["messages"], content, result["usage"])
+        if turn["stream"]:
+            generation_time = result["generation_time"]
+            # A stream that sent no content has no first token, but its latency and tokens still count
+            tokens_per_second = tokens[1] / generation_time if generation_time and result["ttft"] is not None else None
+            _record_response_stats(model_id, result["latency"], tokens,
+                                   ttft=result["ttft"], tokens_per_second=tokens_per_second)
         else:
-            error_msg = f"🔴 **Neural Network Error {response.status_code}**"
+            _record_response_stats(model_id, result["latency"], tokens)
+        if turn["cache_key"] and content:
+            get_response_cache().put(turn["cache_key"], {"content": content, "usage": result["usage"]})
+    elif status in ("cancelled", "timeout") and content:
+        # The partial reply was generated (and billed) even though it was cut short; no usage arrives for it
+        tokens = _account_tokens(model_id, turn["messages"], content, None)
+        _record_response_stats(model_id, generation.elapsed, tokens)
+
+    note = ""
+    if generation is not None and generation.attempts:
+        note += " | ↪️ Skipped " + ", ".join(
+            f"{turn['model_names'][skipped]} ({skipped_status})" for skipped, skipped_status in generation.attempts
+        )
+    if generation is not None and generation.hedged:
+        note += f" | 🪁 Hedged to {turn['model_names'][generation.hedged]}" + (
+            ", which answered first" if generation.hedge_won else ", original answered first"
+        )
+    if status == "error":
+        _show_request_error(generation.error)
+    elif status == "cancelled":
+        note += " | ⏹️ Stopped"
+    elif status == "timeout":
+        note += f" | ⏱️ Cut off at the {turn['deadline']:.0f}s deadline"
+
+    trace.root.set(status=status, served_by=model_id)
+    if content:
+        model_name = turn["model_names"][model_id]
+        if turn["auto"]:
+            model_name = f"{AUTO_MODEL} → {model_name}"
+        store_reply(content, model_name, turn["context_info"], note)
+    elif status == "cancelled":
+        st.info("⏹️ Stopped before any output arrived.")
+    elif status == "timeout":
+        st.warning(f"⏱️ No answer within the {turn['deadline']:.0f}s deadline.")
+    else:
+        st.error("🔴 **Neural communication failed** - Please retry or check your connection.")
+    st.session_state.generation = None
+    trace.finish()
+    record_trace(trace)
+
+def store_reply(content: str, model_name: str, context_info: Dict, note: str = ""):
+    """Caption an assistant reply and add it to the conversation"""
+    st.caption(
+        f"🕐 {datetime.datetime.now().strftime('%H:%M:%S')} | Model: {model_name} | "
+        f"📚 Context: {context_info['included']} msgs, {context_info['tokens']:,}/{context_info['budget']:,} tokens"
+        + (f" ({context_info['dropped']} older dropped)" if context_info["dropped"] else "")
+        + (f" | 🧭 {context_info['recalled']} recalled" if context_info.get("recalled") else "")
+        + (f" | ✂️ Max tokens cut to {context_info['max_tokens']:,}" if context_info.get("max_tokens") else "")
+        + note
+    )
+    with span("store"):
+        append_chat_message("assistant", content)
+    st.session_state.chat_stats["total_messages"] += 1
+
+def compare_models(messages, models: Dict[str, str], temperature: float, max_tokens: int):
+    """Send the same messages to several models concurrently, yielding (name, result, error) as each lands"""
+    api_key = st.session_state.api_key
+    client = st.session_state.client_id
+    base_url = st.session_state.base_url
+    # Resolve the shared session here; worker threads have no script context
+    session = get_http_session()
+
+    with ThreadPoolExecutor(max_workers=len(models)) as pool:
+        # Each worker runs in a copy of this context so its spans join the current trace
+        futures = {
+            pool.submit(
+                contextvars.copy_context().run, request_completion, api_key, messages, model_id, temperature, max_tokens, session, client, base_url
+            ): name
+            for name, model_id in models.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
             try:
-                error_detail = response.json().get("error", {}).get("message", response.text)
-                st.error(f"{error_msg}\n```{error_detail}```")
-            except:
-                st.error(f"{error_msg}\n```{response.text}```")
-            return None
-            
-    except requests.exceptions.Timeout:
-        st.error("⏱️ **Connection Timeout** - The AI is taking too long to respond. Try again.")
-        return None
-    except requests.exceptions.RequestException as e:
-        st.error(f"🌐 **Network Disruption**: {str(e)}")
-        return None
-    except Exception as e:
-        st.error(f"⚠️ **System Anomaly**: {str(e)}")
+                yield name, future.result(), None
+            except GroqAPIError as e:
+                yield name, None, f"Error {e.status_code}: {e.detail}"
+            except requests.exceptions.Timeout:
+                yield name, None, "Connection timeout"
+            except Exception as e:
+                yield name, None, str(e)
+
+def render_model_comparison(messages, model_names: List[str], model_info: Dict, temperature: float,
+                            max_tokens: int, primary_model: str):
+    """Render side-by-side answers as they finish; returns the (model_name, content) to keep"""
+    columns = st.columns(len(model_names))
+    placeholders = {}
+    for column, name in zip(columns, model_names):
+        with column:
+            st.markdown(f'<h4 class="cyber-text">{name}</h4>', unsafe_allow_html=True)
+            placeholders[name] = st.empty()
+            placeholders[name].markdown("⏳ *Processing...*")
+
+    start_time = time.time()
+    answers = {}
+    latency_sum = 0.0
+    models = {name: model_info[name]["id"] for name in model_names}
+
+    for name, result, error in compare_models(messages, models, temperature, max_tokens):
+        with placeholders[name].container():
+            if error:
+                st.error(f"🔴 {error}")
+                continue
+            st.markdown(result["content"])
+            st.caption(f"⏱️ {result['latency']:.2f}s | 🔥 {result['usage'].get('total_tokens', 0):,} tokens")
+
+        _record_response_stats(
+            result["model"],
+            result["latency"],
+            _account_tokens(result["model"], messages, result["content"], result["usage"])
+        )
+        answers[name] = result["content"]
+        latency_sum += result["latency"]
+
+    if answers:
+        st.caption(f"🔀 Fan-out wall time {time.time() - start_time:.2f}s (sequential: ~{latency_sum:.2f}s)")
+
+    if primary_model in answers:
+        return primary_model, answers[primary_model]
+    for name in model_names:
+        if name in answers:
+            return name, answers[name]
+    return primary_model, None
+
+# Persistent conversation store
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "chat_sessions.db")
+SESSION_PAGE_SIZE = int(os.environ.get("SESSION_PAGE_SIZE", "100"))
+SESSION_LIST_LIMIT = 50
+HISTORY_WINDOW = int(os.environ.get("HISTORY_WINDOW", "20"))
+SEARCH_RESULTS_LIMIT = 8
+SEARCH_SNIPPET_TOKENS = 12
+
+_SEARCH_TERM = re.compile(r'"([^"]*)"?|(\S+)')
+
+def build_match_query(query: str) -> str:
+    """FTS5 MATCH expression for a search box query, with the last word matched as a prefix"""
+    terms = []
+    for phrase, word in _SEARCH_TERM.findall(query):
+        text = (phrase or word).strip()
+        if text:
+            terms.append(('"' + text.replace('"', '""') + '"', bool(word)))
+    if terms and terms[-1][1]:
+        terms[-1] = (terms[-1][0] + "*", True)
+    return " ".join(term for term, _ in terms)
+
+# Per browser session; keep it well above the largest context window (32K tokens is ~128 KB of text)
+MESSAGE_MEMORY_BUDGET = int(os.environ.get("MESSAGE_MEMORY_BUDGET", str(1024 * 1024)))
+
+@st.cache_resource
+def get_memory_registry() -> SessionMemoryRegistry:
+    return SessionMemoryRegistry()
+
+class SessionStore:
+    """Named conversations persisted to SQLite, scoped by owner and searchable"""
+
+    def __init__(self, db_path: str = SESSION_DB_PATH):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            indexed = self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'message_search'"
+            ).fetchone() is not None
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL DEFAULT '',
+                    name TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS message_vectors (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    embedder TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                ) WITHOUT ROWID;
+            """)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+            if "owner" not in columns:
+                # Databases from before sessions had owners; their conversations belong to nobody
+                self._db.execute("ALTER TABLE sessions ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+            self._db.execute("DROP INDEX IF EXISTS idx_sessions_updated")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_owner ON sessions (owner, updated DESC)")
+            try:
+                self._db.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+                        content, session_id UNINDEXED, seq UNINDEXED, role UNINDEXED,
+                        tokenize = 'porter unicode61 remove_diacritics 2'
+                    )
+                """)
+                self.searchable = True
+            except sqlite3.OperationalError:
+                self.searchable = False  # SQLite built without FTS5
+            if self.searchable and not indexed:
+                # One-off backfill for databases created before the index existed
+                self._db.execute(
+                    "INSERT INTO message_search (content, session_id, seq, role) "
+                    "SELECT content, session_id, seq, role FROM messages"
+                )
+            self._db.commit()
+
+    def create_session(self, name: str, owner: str) -> str:
+        session_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO sessions (id, owner, name, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (session_id, owner, name, now, now)
+            )
+            self._db.commit()
+        return session_id
+
+    def owns(self, session_id: str, owner: str) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM sessions WHERE id = ? AND owner = ?", (session_id, owner)
+            ).fetchone() is not None
+
+    def list_sessions(self, owner: str, limit: int = SESSION_LIST_LIMIT, offset: int = 0) -> List[Dict]:
+        """The owner's most recently updated sessions, metadata only"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, name, created, updated, message_count FROM sessions WHERE owner = ? "
+                "ORDER BY updated DESC LIMIT ? OFFSET ?",
+                (owner, limit, offset)
+            ).fetchall()
+        return [
+            {"id": row[0], "name": row[1], "created": row[2], "updated": row[3], "message_count": row[4]}
+            for row in rows
+        ]
+
+    def delete_session(self, session_id: str, owner: str):
+        """Delete a session with its messages, if it belongs to owner"""
+        with self._lock:
+            if self._db.execute(
+                "SELECT 1 FROM sessions WHERE id = ? AND owner = ?", (session_id, owner)
+            ).fetchone() is None:
+                return
+            self._db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            if self.searchable:
+                self._db.execute("DELETE FROM message_search WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM message_vectors WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.commit()
+
+    def append_message(self, session_id: str, role: str, content: str,
+                       vector: Optional[Tuple[str, bytes]] = None) -> int:
+        """Persist a message, and its (embedder, vector) if given; returns its sequence number within the session"""
+        now = time.time()
+        with self._lock:
+            seq = self._db.execute(
+                "SELECT message_count FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()[0]
+            self._db.execute(
+                "INSERT INTO messages (session_id, seq, role, content, created) VALUES (?, ?, ?, ?, ?)",
+                (session_id, seq, role, content, now)
+            )
+            if self.searchable:
+                self._db.execute(
+                    "INSERT INTO message_search (content, session_id, seq, role) VALUES (?, ?, ?, ?)",
+                    (content, session_id, seq, role)
+                )
+            if vector is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO message_vectors (session_id, seq, embedder, vector) VALUES (?, ?, ?, ?)",
+                    (session_id, seq, *vector)
+                )
+            self._db.execute(
+                "UPDATE sessions SET message_count = ?, updated = ? WHERE id = ?",
+                (seq + 1, now, session_id)
+            )
+            self._db.commit()
+        return seq
+
+    def search(self, query: str, owner: str, session_id: Optional[str] = None,
+               limit: int = SEARCH_RESULTS_LIMIT) -> List[Dict]:
+        """Best BM25 matches for a search box query among the owner's sessions, optionally within one"""
+        match = build_match_query(query)
+        if not self.searchable or not match:
+            return []
+        sql = (
+            "SELECT message_search.session_id, message_search.seq, message_search.role, sessions.name, "
+            "snippet(message_search, 0, '**', '**', '…', ?), rank "
+            "FROM message_search JOIN sessions ON sessions.id = message_search.session_id "
+            "WHERE message_search MATCH ? AND sessions.owner = ?"
+        )
+        params = [SEARCH_SNIPPET_TOKENS, match, owner]
+        if session_id is not None:
+            sql += " AND message_search.session_id = ?"
+            params.append(session_id)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        try:
+            with self._lock:
+                rows = self._db.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            return []  # a query FTS5 still can't parse just finds nothing
+        return [
+            {"session_id": row[0], "seq": row[1], "role": row[2], "session_name": row[3],
+             "snippet": row[4], "score": -row[5]}
+            for row in rows
+        ]
+
+    def load_messages(self, session_id: str, before_seq: Optional[int] = None,
+                      limit: int = SESSION_PAGE_SIZE) -> List[Dict]:
+        """The page of messages just before before_seq (or the latest page), oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, role, content, created FROM messages WHERE session_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (session_id, before_seq if before_seq is not None else 2 ** 62, limit)
+            ).fetchall()
+        return [ChatMessage(role, content, seq, created) for seq, role, content, created in reversed(rows)]
+
+    def get_messages(self, session_id: str, seqs: List[int]) -> Dict[int, ChatMessage]:
+        """Specific messages of a session by sequence number"""
+        if not seqs:
+            return {}
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT seq, role, content, created FROM messages WHERE session_id = ? "
+                f"AND seq IN ({', '.join('?' * len(seqs))})",
+                (session_id, *seqs)
+            ).fetchall()
+        return {seq: ChatMessage(role, content, seq, created) for seq, role, content, created in rows}
+
+    def load_vectors(self, session_id: str, embedder: str) -> List[Tuple[int, bytes]]:
+        """Stored (seq, vector) pairs of a session made by embedder, in order"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT seq, vector FROM message_vectors WHERE session_id = ? AND embedder = ? ORDER BY seq",
+                (session_id, embedder)
+            ).fetchall()
+
+    def unembedded_messages(self, session_id: str, embedder: str) -> List[Tuple[int, str]]:
+        """(seq, content) of messages with no vector from embedder yet, e.g. stored before recall existed"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT m.seq, m.content FROM messages m LEFT JOIN message_vectors v "
+                "ON v.session_id = m.session_id AND v.seq = m.seq AND v.embedder = ? "
+                "WHERE m.session_id = ? AND v.seq IS NULL ORDER BY m.seq",
+                (embedder, session_id)
+            ).fetchall()
+
+    def save_vectors(self, session_id: str, embedder: str, rows: List[Tuple[int, bytes]]):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO message_vectors (session_id, seq, embedder, vector) VALUES (?, ?, ?, ?)",
+                [(session_id, seq, embedder, vector) for seq, vector in rows]
+            )
+            self._db.commit()
+
+    def iter_messages(self, session_id: str, page_size: int = SESSION_PAGE_SIZE):
+        """Every message of a session in order, read one page at a time"""
+        after_seq = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT seq, role, content, created FROM messages WHERE session_id = ? AND seq > ? "
+                    "ORDER BY seq LIMIT ?",
+                    (session_id, after_seq, page_size)
+                ).fetchall()
+            for seq, role, content, created in rows:
+                yield ChatMessage(role, content, seq, created)
+            if len(rows) < page_size:
+                return
+            after_seq = rows[-1][0]
+
+@st.cache_resource
+def get_session_store() -> SessionStore:
+    """Process-wide handle on the conversation store"""
+    return SessionStore(SESSION_DB_PATH)
+
+def session_owner() -> Optional[str]:
+    """Whose stored conversations this browser session sees: the API key's digest, or the session if keyless"""
+    api_key = st.session_state.get("api_key")
+    if not api_key:
         return None
+    if api_key == KEYLESS_API_KEY:
+        return f"client:{st.session_state.client_id}"
+    return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def sync_session_owner():
+    """Follow a change of API key: list that key's conversations and leave one it doesn't own"""
+    owner = session_owner()
+    if owner == st.session_state.session_owner:
+        return
+    st.session_state.session_owner = owner
+    current = st.session_state.current_session
+    if current is not None and (owner is None or not get_session_store().owns(current, owner)):
+        switch_session(None)
+    refresh_session_list()
+
+def refresh_session_list():
+    """Reload the sidebar's session metadata from the store"""
+    owner = st.session_state.get("session_owner")
+    st.session_state.chat_sessions = {} if owner is None else {
+        session["id"]: session for session in get_session_store().list_sessions(owner)
+    }
+
+def switch_session(session_id: Optional[str]):
+    """Make session_id the active conversation, loading only its latest page of messages"""
+    if session_id is not None and not get_session_store().owns(session_id, st.session_state.session_owner):
+        session_id = None
+    stop_generation()
+    st.session_state.current_session = session_id
+    st.session_state.search_target = None
+    st.session_state.history_window = HISTORY_WINDOW
+    if session_id is None:
+        st.session_state.messages = MessageHistory()
+        st.session_state.history_has_more = False
+        return
+    messages = get_session_store().load_messages(session_id)
+    st.session_state.messages = MessageHistory(messages)
+    st.session_state.history_has_more = bool(messages) and messages[0]["seq"] > 0
+
+def load_earlier_messages():
+    """Prepend the previous page of the active conversation from the store"""
+    messages = st.session_state.messages
+    if not st.session_state.current_session or not messages:
+        return
+    earlier = get_session_store().load_messages(st.session_state.current_session, messages[0]["seq"])
+    messages.prepend(earlier)
+    st.session_state.history_has_more = bool(earlier) and earlier[0]["seq"] > 0
+    enforce_memory_budget()
+
+def enforce_memory_budget():
+    """Spill the oldest in-memory messages of a stored conversation once it is over budget"""
+    if st.session_state.current_session is None:
+        return  # nothing on disk to page back from
+    if st.session_state.messages.spill(MESSAGE_MEMORY_BUDGET, st.session_state.history_window):
+        st.session_state.history_has_more = True
+
+def jump_to_turn(session_id: str, seq: int):
+    """Open session_id with message seq loaded and inside the rendered window"""
+    if not get_session_store().owns(session_id, st.session_state.session_owner):
+        return
+    if session_id != st.session_state.current_session:
+        switch_session(session_id)
+    messages = st.session_state.messages
+    if messages and messages[0]["seq"] > seq:
+        # One read for the whole gap rather than paging back to it
+        earlier = get_session_store().load_messages(session_id, messages[0]["seq"], messages[0]["seq"] - seq)
+        messages.prepend(earlier)
+        st.session_state.history_has_more = bool(earlier) and earlier[0]["seq"] > 0
+    position = next((i for i, m in enumerate(messages) if m["seq"] == seq), None)
+    if position is not None:
+        st.session_state.history_window = max(st.session_state.history_window, len(messages) - position)
+    enforce_memory_budget()
+    st.session_state.search_target = seq
+    st.session_state.scroll_to_target = True
+
+def render_search_results(query: str):
+    """Sidebar hits for a search query; clicking one jumps to its turn"""
+    store = get_session_store()
+    if not store.searchable:
+        st.caption("Search needs SQLite built with FTS5")
+        return
+    owner = st.session_state.session_owner
+    if owner is None:
+        st.caption("Enter an API key to search your conversations")
+        return
+    scope = None
+    if st.session_state.current_session is not None and st.checkbox("This conversation only", key="search_scope"):
+        scope = st.session_state.current_session
+    start = time.perf_counter()
+    hits = store.search(query, owner, scope)
+    elapsed = time.perf_counter() - start
+    if not hits:
+        st.caption(f"No matches · {elapsed * 1000:.1f} ms")
+        return
+    st.caption(f"Top {len(hits)} matches · {elapsed * 1000:.1f} ms")
+    for hit in hits:
+        icon = "👤" if hit["role"] == "user" else "🤖"
+        st.button(
+            f"{icon} {hit['session_name']} #{hit['seq'] + 1}: {hit['snippet']}",
+            key=f"search_hit_{hit['session_id']}_{hit['seq']}",
+            on_click=jump_to_turn,
+            args=(hit["session_id"], hit["seq"]),
+            use_container_width=True
+        )
+
+def append_chat_message(role: str, content: str):
+    """Add a message to the active conversation, creating a stored session on the first one"""
+    store = get_session_store()
+    if st.session_state.current_session is None:
+        name = content.strip().split("\n", 1)[0][:40] or "Untitled chat"
+        st.session_state.current_session = store.create_session(name, st.session_state.session_owner or session_owner())
+    embedder = get_embedder()
+    vector = embedder.embed(content)
+    seq = store.append_message(st.session_state.current_session, role, content, (embedder.name, vector.tobytes()))
+    index = get_recall_indexes().peek(st.session_state.current_session)
+    if index is not None:
+        index.add([seq], vector[None, :])
+    st.session_state.messages.add(ChatMessage(role, content, seq, time.time()))
+    enforce_memory_budget()
+    refresh_session_list()
+
+def render_chat_history():
+    """Render the newest history_window messages behind a "load earlier" control"""
+    messages = st.session_state.messages
+    window = st.session_state.history_window
+    hidden = max(len(messages) - window, 0)
+
+    if hidden or st.session_state.history_has_more:
+        label = f"⬆️ Load earlier messages ({hidden} hidden)" if hidden else "⬆️ Load earlier messages"
+        if st.button(label):
+            # Widen first so the memory budget doesn't spill the page being loaded
+            st.session_state.history_window += HISTORY_WINDOW
+            if not hidden:
+                load_earlier_messages()
+            st.rerun()
+
+    visible = messages[hidden:]
+    target = st.session_state.search_target
+    for i, message in enumerate(visible):
+        with st.chat_message(message["role"]):
+            if target is not None and message.get("seq") == target:
+                st.markdown(f'<div id="turn-{target}"></div>', unsafe_allow_html=True)
+                st.caption("🔎 Search match")
+            st.markdown(message["content"])
+
+            # Add timestamp for recent messages
+            if i >= len(visible) - 5 and message.get("time"):
+                st.caption(f"🕐 {message['time']}")
+
+    if target is not None and st.session_state.pop("scroll_to_target", False):
+        # The script runs in a same-origin iframe, so it can scroll the app page
+        scroll_script = (
+            f'<script>window.parent.document.getElementById("turn-{target}")'
+            f'?.scrollIntoView({{behavior: "smooth", block: "center"}});</script>'
+        )
+        if hasattr(st, "iframe"):
+            st.iframe(scroll_script, height=1)
+        else:
+            import streamlit.components.v1 as components  # superseded by st.iframe in newer Streamlit
+            components.html(scroll_script, height=0)
+
+def _on_session_picked():
+    switch_session(st.session_state.session_picker)
+
+def _format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:,.0f} {unit}" if unit == "B" else f"{size:,.1f} {unit}"
+        size /= 1024
+    return f"{size:,.1f} GB"
 
 def create_stats_dashboard():
     """Create an interactive stats dashboard"""
     stats = st.session_state.chat_stats
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+
     with col1:
         st.markdown("""
         <div class="metric-card">
@@ -367,7 +1618,7 @@ def create_stats_dashboard():
             <h2 style="color: white; margin: 0;">{}</h2>
         </div>
         """.format(stats["total_messages"]), unsafe_allow_html=True)
-    
+
     with col2:
         st.markdown("""
         <div class="metric-card">
@@ -375,16 +1626,16 @@ def create_stats_dashboard():
             <h2 style="color: white; margin: 0;">{:,}</h2>
         </div>
         """.format(stats["total_tokens"]), unsafe_allow_html=True)
-    
+
     with col3:
-        avg_time = stats["average_response_time"]
+        avg_time = stats["latency"].mean
         st.markdown("""
         <div class="metric-card">
             <h3 class="cyber-text">⚡ Avg Speed</h3>
             <h2 style="color: white; margin: 0;">{:.1f}s</h2>
         </div>
         """.format(avg_time), unsafe_allow_html=True)
-    
+
     with col4:
         session_time = datetime.datetime.now() - stats["session_start"]
         st.markdown("""
@@ -394,116 +1645,420 @@ def create_stats_dashboard():
         </div>
         """.format(str(session_time).split('.')[0]), unsafe_allow_html=True)
 
+    with col5:
+        st.markdown("""
+        <div class="metric-card">
+            <h3 class="cyber-text">💾 Cache</h3>
+            <h2 style="color: white; margin: 0;">{} / {}</h2>
+        </div>
+        """.format(stats["cache_hits"], stats["cache_hits"] + stats["cache_misses"]), unsafe_allow_html=True)
+
+    p50, p95, p99 = stats["latency"].percentiles(50, 95, 99)
+    ttft_p50, = stats["ttft"].percentiles(50)
+    latency_cards = [
+        ("📉 p50 Latency", p50, "{:.2f}s"),
+        ("📊 p95 Latency", p95, "{:.2f}s"),
+        ("🚨 p99 Latency", p99, "{:.2f}s"),
+        ("⏱️ TTFT p50", ttft_p50, "{:.2f}s"),
+        ("🚄 Tokens/sec", stats["throughput"].mean if stats["throughput"].count else None, "{:.0f}")
+    ]
+    for column, (title, value, fmt) in zip(st.columns(len(latency_cards)), latency_cards):
+        with column:
+            st.markdown("""
+            <div class="metric-card">
+                <h3 class="cyber-text">{}</h3>
+                <h2 style="color: white; margin: 0;">{}</h2>
+            </div>
+            """.format(title, fmt.format(value) if value is not None else "—"), unsafe_allow_html=True)
+
+    messages = st.session_state.messages
+    totals = get_memory_registry().totals()
+    recall_bytes = get_recall_indexes().nbytes([st.session_state.current_session])
+    st.caption(
+        f"🧠 Memory: this session {_format_bytes(messages.nbytes)} in {len(messages):,} messages "
+        f"({messages.on_disk:,} older on disk) + {_format_bytes(stats['request_log'].nbytes)} request log"
+        + (f" + {_format_bytes(recall_bytes)} recall index" if recall_bytes else "")
+        + f" | all sessions {_format_bytes(totals['bytes'])} in {totals['messages']:,} messages across {totals['sessions']} | "
+        f"budget {_format_bytes(MESSAGE_MEMORY_BUDGET)} per session"
+    )
+
+    if stats["cache_hits"] + stats["cache_misses"]:
+        cache_stats = get_response_cache().stats()
+        st.caption(
+            f"💾 Shared cache: {cache_stats['entries']} entries | "
+            f"{cache_stats['memory_hits']} memory hits | {cache_stats['disk_hits']} disk hits | "
+            f"{cache_stats['misses']} misses"
+        )
+
+# Requests plotted in the analytics panel; older history is still in the log
+ANALYTICS_POINTS = 1000
+CHART_COLORS = ["#00d4ff", "#7c3aed", "#f59e0b", "#10b981"]
+
+def _style_chart(fig, title: str):
+    fig.update_layout(
+        title=title,
+        template="plotly_dark",
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        font=dict(family="Rajdhani, sans-serif"),
+        margin=dict(l=10, r=10, t=40, b=10),
+        height=300
+    )
+    return fig
+
+def create_analytics_panel():
+    """Latency and token charts built from the session's columnar request log"""
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    log = st.session_state.chat_stats["request_log"]
+    if not len(log):
+        st.info("📡 No requests yet - analytics appear after the first response.")
+        return
+
+    frame = log.to_frame(last=ANALYTICS_POINTS)
+    color_map = {model: CHART_COLORS[i % len(CHART_COLORS)] for i, model in enumerate(log.models)}
+
+    col1, col2 = st.columns(2)
+    with col1:
+        fig = px.line(frame, x="timestamp", y="latency", color="model", markers=True,
+                      color_discrete_map=color_map, labels={"latency": "Latency (s)", "timestamp": ""})
+        st.plotly_chart(_style_chart(fig, "⚡ Latency over time"), use_container_width=True)
+
+    with col2:
+        fig = go.Figure()
+        fig.add_bar(x=frame.index, y=frame["prompt_tokens"], name="Prompt", marker_color=CHART_COLORS[1])
+        fig.add_bar(x=frame.index, y=frame["completion_tokens"], name="Completion", marker_color=CHART_COLORS[0])
+        fig.update_layout(barmode="stack", xaxis_title="Request", yaxis_title="Tokens")
+        st.plotly_chart(_style_chart(fig, "🔥 Tokens per request"), use_container_width=True)
+
+    col3, col4 = st.columns(2)
+    with col3:
+        fig = px.box(frame, x="model", y="latency", color="model", points="all",
+                     color_discrete_map=color_map, labels={"latency": "Latency (s)", "model": ""})
+        fig.update_layout(showlegend=False)
+        st.plotly_chart(_style_chart(fig, "🧠 Latency by model"), use_container_width=True)
+
+    with col4:
+        fig = px.histogram(frame, x="latency", nbins=30, color_discrete_sequence=[CHART_COLORS[2]],
+                           labels={"latency": "Latency (s)"})
+        st.plotly_chart(_style_chart(fig, "📊 Latency distribution"), use_container_width=True)
+
+TRACE_PANEL_SIZE = int(os.environ.get("TRACE_PANEL_SIZE", "20"))
+# Column order of the trace table; phases a turn didn't go through are left blank
+TRACE_PHASES = ("store", "context_window", "cache", "serialize", "rate_limit", "http", "stream", "parse", "server", "render")
+PROFILE_TOP_FUNCTIONS = 40
+
+def record_trace(trace: Trace):
+    """Keep a finished trace for the debug panel and hand it to the exporter, if any"""
+    st.session_state.traces.append(trace)
+    exporter = get_trace_exporter()
+    if exporter is not None:
+        exporter.export(trace)
+
+def create_trace_panel():
+    """Phase breakdown of the last TRACE_PANEL_SIZE turns plus a one-rerun profiler"""
+    traces = st.session_state.traces
+    if not traces:
+        st.info("🔬 No traced requests yet - send a message to record one.")
+    else:
+        rows = []
+        for trace in reversed(traces):
+            phases = trace.phases()
+            row = {
+                "time": format_clock(trace.root.start_ns / 1e9),
+                "model": trace.root.attributes.get("model"),
+                "mode": trace.root.attributes.get("mode"),
+                "total ms": round(trace.duration_ms, 1)
+            }
+            for phase in TRACE_PHASES:
+                row[f"{phase} ms"] = round(phases[phase], 1) if phase in phases else None
+            if trace.root.error:
+                row["error"] = trace.root.error
+            rows.append(row)
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        st.caption(
+            "server is the time the API reports spending, inside http or stream. "
+            "When streaming, render is summed across redraws and also counted in stream."
+        )
+
+        with st.expander("🧵 Spans of the latest turn"):
+            latest = traces[-1]
+            st.dataframe(
+                [
+                    {"span": s.name, "ms": round(s.duration_ms, 2), "error": s.error, **s.attributes}
+                    for s in latest.spans[1:]
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+
+        exporter = get_trace_exporter()
+        if exporter is not None:
+            export_stats = exporter.stats()
+            st.caption(
+                f"📤 OTLP export: {export_stats['exported']} sent | {export_stats['queued']} queued | "
+                f"{export_stats['dropped']} dropped | {export_stats['failed']} failed"
+            )
+
+    if st.button("🧪 Profile next rerun", help="Capture one full script run with cProfile"):
+        st.session_state.profile_next_run = True
+        st.rerun()
+
+    report = st.session_state.get("profile_report")
+    if report:
+        st.markdown(f"**cProfile of the {report['time']} rerun** (top {PROFILE_TOP_FUNCTIONS} by cumulative time)")
+        st.code(report["text"], language=None)
+        st.download_button(
+            "📥 Download .prof",
+            data=report["data"],
+            file_name=f"rerun_{report['time'].replace(':', '')}.prof",
+            help="Open with pstats or snakeviz"
+        )
+
+def run_profiled(target):
+    """Run target under cProfile and keep the report for the trace panel"""
+    import cProfile
+    import io
+    import marshal
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        target()
+    finally:
+        profiler.disable()
+        text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=text)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        st.session_state.profile_report = {
+            "time": format_clock(time.time()),
+            "text": text.getvalue(),
+            "data": marshal.dumps(stats.stats)  # the format pstats.Stats.dump_stats writes
+        }
+
+# Export formats: label -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "JSON": ("json", "application/json"),
+    "NDJSON": ("ndjson", "application/x-ndjson"),
+    "Text": ("txt", "text/plain")
+}
+
+def _export_stats() -> Dict:
+    """Session stats converted to JSON-serializable values"""
+    stats = dict(st.session_state.chat_stats)
+    stats["models_used"] = list(stats["models_used"])
+    stats["session_start"] = stats["session_start"].isoformat()
+    for key in ("latency", "ttft", "throughput", "request_log"):
+        stats[key] = stats[key].to_dict()
+    return stats
+
+def iter_export_messages():
+    """Every message of the active conversation, paged from the store when it is saved"""
+    if st.session_state.current_session is None:
+        yield from st.session_state.messages
+        return
+    yield from get_session_store().iter_messages(st.session_state.current_session)
+
+def _export_record(message: Dict) -> Dict:
+    record = {"role": message["role"], "content": message["content"]}
+    if "time" in message:
+        record["time"] = message["time"]
+    return record
+
+def iter_export_json(messages, stats: Dict):
+    """Chunks of a single JSON document; messages are serialized one at a time"""
+    yield '{\n  "timestamp": %s,\n  "stats": %s,\n  "messages": [' % (
+        json.dumps(datetime.datetime.now().isoformat()),
+        json.dumps(stats, allow_nan=False)
+    )
+    separator = "\n    "
+    for message in messages:
+        yield separator + json.dumps(_export_record(message), allow_nan=False)
+        separator = ",\n    "
+    yield "\n  ]\n}\n"
+
+def iter_export_ndjson(messages, stats: Dict):
+    """One JSON object per line: a metadata record followed by the messages"""
+    yield json.dumps({"type": "meta", "timestamp": datetime.datetime.now().isoformat(), "stats": stats}, allow_nan=False) + "\n"
+    for message in messages:
+        yield json.dumps({"type": "message", **_export_record(message)}, allow_nan=False) + "\n"
+
+def iter_export_text(messages):
+    """Readable transcript, one chunk per message"""
+    yield f"AI Neural Interface Chat Export\n{'='*50}\n\n"
+    for message in messages:
+        role = "🤖 AI" if message["role"] == "assistant" else "👤 You"
+        yield f"{role}:\n{message['content']}\n\n"
+
+def encode_export(chunks, compress: bool = False):
+    """UTF-8 encode text chunks, optionally through a streaming gzip compressor"""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode("utf-8")
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def build_export(export_format: str, compress: bool) -> bytes:
+    """Produce an export in one linear pass over the conversation"""
+    messages = iter_export_messages()
+    if export_format == "Text":
+        chunks = iter_export_text(messages)
+    elif export_format == "NDJSON":
+        chunks = iter_export_ndjson(messages, _export_stats())
+    else:
+        chunks = iter_export_json(messages, _export_stats())
+    return b"".join(encode_export(chunks, compress))
+
+def _discard_export():
+    """Drop a served export so it doesn't stay pinned in session state"""
+    st.session_state.pop("export_payload", None)
+
 def export_chat_history():
-    """Export chat history as JSON or text"""
+    """Export chat history on request as JSON, NDJSON or text, optionally gzipped"""
     if not st.session_state.messages:
         st.warning("No chat history to export!")
         return
-    
-    # Create export data
-    export_data = {
-        "timestamp": datetime.datetime.now().isoformat(),
-        "stats": dict(st.session_state.chat_stats),
-        "messages": st.session_state.messages
-    }
-    
-    # Convert set to list for JSON serialization
-    export_data["stats"]["models_used"] = list(export_data["stats"]["models_used"])
-    export_data["stats"]["session_start"] = export_data["stats"]["session_start"].isoformat()
-    
-    json_str = json.dumps(export_data, indent=2)
-    
+
     col1, col2 = st.columns(2)
     with col1:
-        st.download_button(
-            label="📥 Download JSON",
-            data=json_str,
-            file_name=f"chat_history_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-            mime="application/json"
-        )
-    
+        export_format = st.selectbox("Format:", options=list(EXPORT_FORMATS.keys()))
     with col2:
-        # Create readable text format
-        text_export = f"AI Neural Interface Chat Export\n{'='*50}\n\n"
-        for msg in st.session_state.messages:
-            role = "🤖 AI" if msg["role"] == "assistant" else "👤 You"
-            text_export += f"{role}:\n{msg['content']}\n\n"
-        
+        compress = st.checkbox("🗜️ gzip", help="Compress the export")
+
+    # Exports are only built on request, and only offered while they match the current chat
+    export_key = (st.session_state.current_session, len(st.session_state.messages), export_format, compress)
+    if st.button("📦 Prepare Export", use_container_width=True):
+        extension, mime = EXPORT_FORMATS[export_format]
+        if compress:
+            extension, mime = extension + ".gz", "application/gzip"
+        st.session_state.export_payload = {
+            "key": export_key,
+            "data": build_export(export_format, compress),
+            "file_name": f"chat_history_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+            "mime": mime
+        }
+
+    payload = st.session_state.get("export_payload")
+    if payload and payload["key"] != export_key:
+        # Stale once the chat or the options change; don't keep megabytes around for it
+        del st.session_state.export_payload
+    elif payload:
         st.download_button(
-            label="📄 Download Text",
-            data=text_export,
-            file_name=f"chat_history_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-            mime="text/plain"
+            label=f"📥 Download {export_format} ({len(payload['data']) / 1024:,.1f} KB)",
+            data=payload["data"],
+            file_name=payload["file_name"],
+            mime=payload["mime"],
+            on_click=_discard_export,
+            use_container_width=True
         )
 
 def main():
     # Inject custom CSS
     inject_css()
-    
+
     # Initialize session state
     initialize_session_state()
-    
+    # /metrics endpoint and file dump, if configured; a no-op after the first run
+    metrics.start_exporters()
+
     # Custom header
-    st.markdown("""
-    <div class="main-header">
-        <h1>🚀 AI NEURAL INTERFACE</h1>
-        <p>Advanced Multi-Model AI Communication Platform</p>
-    </div>
-    """, unsafe_allow_html=True)
-    
+    st.markdown(get_static_assets()["header"], unsafe_allow_html=True)
+
     # Get model information
     model_info = get_model_info()
-    
+
     # Enhanced sidebar
     with st.sidebar:
         st.markdown('<h2 class="cyber-text">🔧 CONTROL PANEL</h2>', unsafe_allow_html=True)
-        
+
         # API Configuration
         st.markdown('<div class="glass-panel">', unsafe_allow_html=True)
         st.markdown("#### 🔑 Neural Link Authentication")
-        
+
+        providers = get_providers()
+        provider_name = st.selectbox(
+            "Provider:",
+            list(providers.keys()),
+            help="Any OpenAI-compatible endpoint; the local mock needs no key or network"
+        )
+        provider = providers[provider_name]
+        st.session_state.base_url = provider["base_url"]
+        if provider_name != "Groq":
+            st.caption(f"🛰️ {provider['description']} · `{provider['base_url']}`")
+
         api_key_input = st.text_input(
             "Groq API Key:",
             type="password",
             placeholder="gsk_...",
             help="Your Groq API key for neural network access"
         )
-        
+
         if api_key_input:
             st.session_state.api_key = api_key_input
             st.markdown('<p class="success-text">✅ Neural link established!</p>', unsafe_allow_html=True)
-        elif "api_key" not in st.session_state:
-            st.markdown('<p class="warning-text">⚠️ Neural link required</p>', unsafe_allow_html=True)
-        
+        elif not provider["requires_key"]:
+            # Keyless endpoints still get a bearer token so the request path stays uniform
+            st.session_state.api_key = st.session_state.get("api_key") or KEYLESS_API_KEY
+            st.markdown('<p class="success-text">✅ Local link, no key needed</p>', unsafe_allow_html=True)
+        else:
+            if st.session_state.get("api_key") == KEYLESS_API_KEY:
+                del st.session_state.api_key  # placeholder left over from a keyless provider
+            if "api_key" not in st.session_state:
+                st.markdown('<p class="warning-text">⚠️ Neural link required</p>', unsafe_allow_html=True)
+        sync_session_owner()
+
         st.markdown('</div>', unsafe_allow_html=True)
-        
+
         # Model Configuration
         st.markdown('<div class="glass-panel">', unsafe_allow_html=True)
         st.markdown("#### 🧠 AI Model Selection")
-        
+
         selected_model = st.selectbox(
             "Choose AI Model:",
-            options=list(model_info.keys()),
-            index=0,
-            help="Select the AI model for processing"
+            options=[AUTO_MODEL] + list(model_info.keys()),
+            index=1,
+            help="Select the AI model for processing, or let Auto pick the fastest healthy one per prompt"
         )
-        
+
         # Display model info
-        model_data = model_info[selected_model]
-        st.markdown(f"""
-        **{model_data['description']}**
-        
-        📊 **Context**: {model_data['context']}  
-        💰 **Price**: {model_data['price']}  
-        🏷️ **Category**: {model_data['category']}
-        """)
-        
+        if selected_model == AUTO_MODEL:
+            st.markdown("**Fastest healthy model whose context fits, with fallback on 429/5xx**")
+            render_router_stats(model_info)
+        else:
+            model_data = model_info[selected_model]
+            st.markdown(f"""
+            **{model_data['description']}**
+
+            📊 **Context**: {model_data['context']}
+            💰 **Price**: {model_data['price']}
+            🏷️ **Category**: {model_data['category']}
+            """)
+
+        compare_mode = st.checkbox(
+            "🔀 Compare models",
+            help="Send each prompt to several models at once and show the answers side by side"
+        )
+        compare_selection = []
+        if compare_mode:
+            compare_selection = st.multiselect(
+                "Models to compare:",
+                options=list(model_info.keys()),
+                default=list(model_info.keys())[:2]
+            )
+
         st.markdown('</div>', unsafe_allow_html=True)
-        
+
         # Advanced Parameters
         st.markdown('<div class="glass-panel">', unsafe_allow_html=True)
         st.markdown("#### ⚙️ Neural Parameters")
-        
+
         temperature = st.slider(
             "🌡️ Creativity Temperature:",
             min_value=0.0,
@@ -512,7 +2067,7 @@ def main():
             step=0.1,
             help="Controls AI creativity and randomness"
         )
-        
+
         max_tokens = st.slider(
             "📏 Response Length:",
             min_value=100,
@@ -521,127 +2076,271 @@ def main():
             step=100,
             help="Maximum response length in tokens"
         )
-        
+
+        deadline = st.number_input(
+            "⏱️ Deadline (s):",
+            min_value=5,
+            max_value=600,
+            value=int(get_model_deadline(model_info[selected_model]["id"]) if selected_model in model_info
+                      else GENERATION_DEADLINE),
+            step=5,
+            help="Stop a reply that runs longer than this, keeping what arrived so far"
+        )
+
+        hedge_requests = st.checkbox(
+            "🪁 Hedge slow requests",
+            value=HEDGE_ENABLED,
+            help="If the first token is later than this model's usual p95, send a duplicate request (to the next "
+                 "fallback in Auto mode) and keep whichever answers first. Capped at a small share of all requests"
+        )
+
+        condense_older = st.checkbox(
+            "🗜️ Condense dropped turns",
+            help="When history exceeds the model's context window, send a short digest of the older turns instead of dropping them outright"
+        )
+
+        recall_older = st.checkbox(
+            "🧭 Recall relevant turns",
+            help=f"Send only the last {RECALL_RECENT_MESSAGES} messages plus the older turns most similar to your prompt, "
+                 "found in a local vector index of the whole conversation. Keeps long chats' prompts small"
+        )
+
+        cache_responses = st.checkbox(
+            "💾 Cache responses",
+            help="Answer repeated prompts from cache. Applies at temperature 0 unless enabled for all temperatures below"
+        )
+        cache_any_temperature = False
+        if cache_responses:
+            cache_any_temperature = st.checkbox(
+                "Cache at any temperature",
+                help="Also reuse answers for sampled (non-deterministic) requests"
+            )
+        use_cache = cache_responses and (temperature == 0 or cache_any_temperature)
+
+        stream_responses = st.checkbox(
+            "⚡ Stream responses",
+            value=True,
+            help="Render tokens as they are generated instead of waiting for the full answer"
+        )
+
         st.markdown('</div>', unsafe_allow_html=True)
-        
+
         # Session Management
         st.markdown('<div class="glass-panel">', unsafe_allow_html=True)
         st.markdown("#### 💾 Session Control")
-        
+
+        # Keep the picker in step with switches made elsewhere (new chat, first message)
+        if st.session_state.get("session_picker") != st.session_state.current_session:
+            st.session_state.session_picker = st.session_state.current_session
+
+        session_labels = {None: "🆕 New conversation"}
+        for session_id, meta in st.session_state.chat_sessions.items():
+            session_labels[session_id] = f"{meta['name']} ({meta['message_count']} msgs)"
+        session_labels.setdefault(st.session_state.current_session, st.session_state.current_session)
+
+        st.selectbox(
+            "Conversation:",
+            options=list(session_labels.keys()),
+            format_func=session_labels.get,
+            key="session_picker",
+            on_change=_on_session_picked,
+            help="Switch between saved conversations"
+        )
+
+        search_query = st.text_input(
+            "🔎 Search conversations:",
+            placeholder='words or "exact phrase"',
+            help="Ranked full-text search over every stored conversation; click a hit to jump to it"
+        )
+        if search_query.strip():
+            render_search_results(search_query)
+
         col1, col2 = st.columns(2)
         with col1:
-            if st.button("🗑️ Clear Chat", use_container_width=True):
-                st.session_state.messages = []
+            if st.button("🆕 New Chat", use_container_width=True):
+                switch_session(None)
                 st.session_state.chat_stats["total_messages"] = 0
                 st.rerun()
-        
+
         with col2:
             if st.button("📊 Reset Stats", use_container_width=True):
-                st.session_state.chat_stats = {
-                    "total_messages": 0,
-                    "total_tokens": 0,
-                    "session_start": datetime.datetime.now(),
-                    "models_used": set(),
-                    "average_response_time": 0,
-                    "response_times": []
-                }
+                st.session_state.chat_stats = new_chat_stats()
                 st.rerun()
-        
+
+        if st.session_state.current_session is not None:
+            if st.button("🗑️ Delete Conversation", use_container_width=True):
+                get_session_store().delete_session(st.session_state.current_session, st.session_state.session_owner)
+                get_recall_indexes().discard(st.session_state.current_session)
+                switch_session(None)
+                refresh_session_list()
+                st.rerun()
+
+        with st.expander("🔌 Connection Pool"):
+            pool_stats = get_pool_stats()
+            st.markdown(f"""
+            🌐 **Hosts**: {pool_stats['hosts']}
+            🔗 **Connections opened**: {pool_stats['connections_opened']}
+            📨 **Requests sent**: {pool_stats['requests']}
+            💤 **Idle keep-alive**: {pool_stats['idle_connections']}
+            """)
+
+        with st.expander("🚦 Rate Limiter"):
+            limiters = get_rate_limiters(st.session_state.base_url)
+            if not limiters:
+                st.caption("No requests sent to this endpoint yet")
+            # Budgets are per model, as the API enforces them
+            for model, limiter in sorted(limiters.items()):
+                limiter_stats = limiter.stats()
+                tokens_line = (
+                    f"{limiter_stats['tokens_available']:,.0f} / {limiter_stats['tokens_per_minute']:,.0f} per min"
+                    if limiter_stats['tokens_per_minute'] else "not yet known"
+                )
+                st.markdown(f"""
+                **{model}**
+                ⏳ **Queued now**: {limiter_stats['queue_depth']}
+                ✅ **Granted**: {limiter_stats['granted']}
+                🛑 **429s absorbed**: {limiter_stats['throttled']}
+                ⌛ **Wait**: avg {limiter_stats['avg_wait']:.2f}s · max {limiter_stats['max_wait']:.2f}s
+                🎚️ **Rate scale**: {limiter_stats['rate_scale']:.0%}
+                🪙 **Token budget**: {tokens_line}
+                """)
+                if limiter_stats['blocked_for'] > 0:
+                    st.caption(f"Paused by the API for another {limiter_stats['blocked_for']:.1f}s")
+
+        with st.expander("🌍 Server Metrics"):
+            render_server_metrics()
+
         # Export options
         if st.session_state.messages:
             st.markdown("#### 📤 Export Data")
             export_chat_history()
-        
+
         st.markdown('</div>', unsafe_allow_html=True)
-    
+
     # Main chat interface
     # Stats dashboard
     st.markdown('<div class="stats-panel">', unsafe_allow_html=True)
     st.markdown('<h3 class="cyber-text">📈 NEURAL NETWORK STATUS</h3>', unsafe_allow_html=True)
     create_stats_dashboard()
+    if st.checkbox("📈 Show analytics", help="Latency and token charts for this session"):
+        create_analytics_panel()
+    if st.checkbox("🔬 Show request traces", help="Where the time went in recent turns, plus a rerun profiler"):
+        create_trace_panel()
     st.markdown('</div>', unsafe_allow_html=True)
-    
+
     # Chat container
     chat_container = st.container()
     with chat_container:
-        # Display chat history with enhanced styling
-        for i, message in enumerate(st.session_state.messages):
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
-                
-                # Add timestamp for recent messages
-                if i >= len(st.session_state.messages) - 5:
-                    st.caption(f"🕐 {datetime.datetime.now().strftime('%H:%M:%S')}")
-    
+        render_chat_history()
+        if st.session_state.generation is not None:
+            render_generation()
+
     # Enhanced chat input
     if prompt := st.chat_input("🎯 Initialize neural communication..."):
         # Validate API key
         if "api_key" not in st.session_state or not st.session_state.api_key:
             st.error("🔐 **Neural Link Required** - Please establish API connection in the control panel.")
             st.stop()
-        
-        # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        st.session_state.chat_stats["total_messages"] += 1
-        
-        # Display user message
-        with st.chat_message("user"):
-            st.markdown(prompt)
-            st.caption(f"🕐 {datetime.datetime.now().strftime('%H:%M:%S')}")
-        
-        # Generate AI response
-        with st.chat_message("assistant"):
-            # Typing indicator
-            typing_placeholder = st.empty()
-            typing_placeholder.markdown("""
-            <div class="typing-indicator">
-                <span>🤖 AI is processing</span>
-                <div class="typing-dot"></div>
-                <div class="typing-dot"></div>
-                <div class="typing-dot"></div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Prepare API messages
-            api_messages = st.session_state.messages[-30:]  # Keep last 30 messages
-            
-            response = get_groq_response(
-                api_messages,
-                model_info[selected_model]["id"],
-                temperature,
-                max_tokens
-            )
-            
-            typing_placeholder.empty()
-            
-            if response:
-                st.markdown(response)
-                st.caption(f"🕐 {datetime.datetime.now().strftime('%H:%M:%S')} | Model: {selected_model}")
-                
-                # Add to chat history
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                st.session_state.chat_stats["total_messages"] += 1
-                
-                # Estimate tokens
-                total_tokens = estimate_tokens(prompt + response)
-                st.session_state.chat_stats["total_tokens"] += total_tokens
-                
-            else:
-                st.error("🔴 **Neural communication failed** - Please retry or check your connection.")
-    
+
+        compare_active = compare_mode and len(compare_selection) > 1
+        auto = selected_model == AUTO_MODEL and not compare_active
+        trace = Trace(
+            "chat_turn",
+            model="auto" if selected_model == AUTO_MODEL else model_info[selected_model]["id"],
+            mode="compare" if compare_active else "stream" if stream_responses else "blocking",
+            endpoint=st.session_state.base_url,
+            history=len(st.session_state.messages)
+        )
+        with use_trace(trace):
+            # Add user message
+            with span("store"):
+                append_chat_message("user", prompt)
+            st.session_state.chat_stats["total_messages"] += 1
+
+            # Display user message
+            with st.chat_message("user"):
+                st.markdown(prompt)
+                st.caption(f"🕐 {datetime.datetime.now().strftime('%H:%M:%S')}")
+
+            # Auto mode picks the fastest healthy model that fits the whole history,
+            # keeping the others that would fit the packed prompt as fallbacks
+            ranked = [selected_model]
+            if auto:
+                with span("route") as route_span:
+                    ranked = route_models(model_info, st.session_state.messages, max_tokens)
+                    route_span.set(model=model_info[ranked[0]]["id"])
+
+            # Pack as much recent history as the model's context window allows;
+            # a comparison has to fit the smallest window among its models
+            target_models = compare_selection if compare_active else ranked[:1]
+            token_counter = get_token_counter()
+            calibration = max(token_counter.calibration(model_info[name]["id"]) for name in target_models)
+            context_limit = min(model_info[name]["context_tokens"] for name in target_models)
+            with span("context_window") as context_span:
+                api_messages, context_info = build_context_window(
+                    st.session_state.messages,
+                    context_limit,
+                    max_tokens,
+                    condense_older,
+                    calibration,
+                    RECALL_RECENT_MESSAGES if recall_older else None
+                )
+                if recall_older:
+                    with span("recall"):
+                        add_recalled_turns(api_messages, context_info, st.session_state.messages,
+                                           st.session_state.current_session, calibration)
+                # A completion reservation larger than what the prompt leaves would be rejected with a 400
+                room = context_limit - context_info["tokens"] - CONTEXT_SAFETY_MARGIN
+                if max_tokens > room:
+                    max_tokens = context_info["max_tokens"] = max(room, 1)
+                context_span.set(**context_info)
+
+            if not compare_active:
+                required = context_info["tokens"] + max_tokens + CONTEXT_SAFETY_MARGIN
+                start_generation(
+                    api_messages,
+                    ranked[0],
+                    model_info[ranked[0]]["id"],
+                    temperature,
+                    max_tokens,
+                    use_cache,
+                    stream_responses,
+                    deadline,
+                    context_info,
+                    trace,
+                    fallbacks={name: model_info[name]["id"] for name in ranked[1:]
+                               if model_info[name]["context_tokens"] >= required},
+                    auto=auto,
+                    hedge=hedge_requests
+                )
+
+        if compare_active:
+            with use_trace(trace), st.chat_message("assistant"):
+                response_model, response = render_model_comparison(
+                    api_messages,
+                    compare_selection,
+                    model_info,
+                    temperature,
+                    max_tokens,
+                    selected_model
+                )
+                if response:
+                    store_reply(response, response_model, context_info)
+                else:
+                    st.error("🔴 **Neural communication failed** - Please retry or check your connection.")
+            trace.finish()
+            record_trace(trace)
+        else:
+            render_generation()
+
     # Footer with enhanced info
     st.markdown("---")
-    st.markdown("""
-    <div style='text-align: center; color: #00d4ff; font-family: Orbitron, monospace;'>
-        <h4>🚀 AI Neural Interface v2.0</h4>
-        <p style='color: rgba(255,255,255,0.7);'>
-            Powered by Groq API • Enhanced Neural Architecture • Built with Streamlit
-        </p>
-        <p style='color: rgba(0,212,255,0.8); font-size: 0.9rem;'>
-            🔬 Advanced AI Communication Platform • 🌐 Multi-Model Support • 📊 Real-time Analytics
-        </p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(get_static_assets()["footer"], unsafe_allow_html=True)
 
 if __name__ == "__main__":
-    main()
+    if st.session_state.pop("profile_next_run", False):
+        run_profiled(main)
+        # The panel rendered before the profile finished; show the report now
+        st.rerun()
+    else:
+        main()
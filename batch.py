@@ -0,0 +1,189 @@
+"""Run a JSONL file of prompts through the Groq API from the command line.
+
+Each line holds a "prompt" or "messages", plus optional "id", "model",
+"temperature" and "max_tokens". Re-running with the same output file
+skips every id already answered:
+
+    {"id": "q1", "prompt": "Explain LPUs in one paragraph"}
+    GROQ_API_KEY=gsk_... python batch.py prompts.jsonl results.jsonl --concurrency 8 --rpm 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Set
+
+import requests
+
+import metrics
+from groq_client import (
+    GROQ_BASE_URL,
+    GroqAPIError,
+    configure_rate_limits,
+    find_model,
+    get_rate_limiters,
+    request_completion
+)
+from tracing import get_trace_exporter, start_trace
+
+def load_completed_ids(output_path: str) -> Set[str]:
+    """Ids already answered successfully in a previous run"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if record.get("status") == "ok":
+                completed.add(str(record["id"]))
+    return completed
+
+def build_job(line_number: int, record: Dict, args) -> Dict:
+    """Resolve one input record into a request"""
+    if "messages" in record:
+        messages = record["messages"]
+    elif "prompt" in record:
+        messages = [{"role": "user", "content": record["prompt"]}]
+    else:
+        raise ValueError("record needs a 'prompt' or 'messages' field")
+
+    model_name = record.get("model", args.model)
+    model = find_model(model_name)
+    if model is None:
+        raise ValueError(f"unknown model {model_name!r}")
+
+    return {
+        "id": str(record.get("id", line_number)),
+        "model": model["id"],
+        "messages": messages,
+        "temperature": record.get("temperature", args.temperature),
+        "max_tokens": record.get("max_tokens", args.max_tokens)
+    }
+
+def run_job(job: Dict, api_key: str, base_url: str) -> Dict:
+    """Blocking call for one prompt; runs on a worker thread"""
+    result = {"id": job["id"], "model": job["model"]}
+    with start_trace("batch_job", model=job["model"], endpoint=base_url, job=job["id"]) as trace:
+        try:
+            completion = request_completion(
+                api_key, job["messages"], job["model"], job["temperature"], job["max_tokens"],
+                client="batch", base_url=base_url
+            )
+            result.update(
+                status="ok",
+                content=completion["content"],
+                usage=completion["usage"],
+                latency=round(completion["latency"], 4)
+            )
+        except GroqAPIError as e:
+            result.update(status="error", error=f"{e.status_code}: {e.detail}")
+        except requests.exceptions.RequestException as e:
+            result.update(status="error", error=str(e))
+        except Exception as e:
+            # A malformed response must not kill the worker; the id is retried on the next run
+            result.update(status="error", error=f"{type(e).__name__}: {e}")
+        if result["status"] == "error":
+            trace.root.error = result["error"]
+    exporter = get_trace_exporter()
+    if exporter is not None:
+        exporter.export(trace)
+    return result
+
+async def run_batch(args, api_key: str) -> Dict[str, int]:
+    completed = load_completed_ids(args.output)
+    if args.rpm:
+        configure_rate_limits(args.base_url, requests_per_minute=args.rpm)
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    loop = asyncio.get_running_loop()
+    # Bounded so a huge input file is read only as fast as workers drain it
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    started = time.time()
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        def write(record: Dict):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[record["status"]] += 1
+            done = counts["ok"] + counts["error"]
+            if done % args.progress_every == 0:
+                rate = done / max(time.time() - started, 1e-9)
+                print(f"{done} done ({counts['error']} errors, {rate:.1f}/s)", file=sys.stderr)
+
+        async def worker():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    queue.task_done()
+                    return
+                result = await loop.run_in_executor(executor, run_job, job, api_key, args.base_url)
+                write(result)
+                queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+
+        with open(args.input, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    job = build_job(line_number, json.loads(line), args)
+                except ValueError as e:
+                    write({"id": str(line_number), "status": "error", "error": f"bad input: {e}"})
+                    continue
+                if job["id"] in completed:
+                    counts["skipped"] += 1
+                    continue
+                await queue.put(job)
+
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    executor.shutdown()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("output", help="JSONL file results are appended to (also the resume checkpoint)")
+    parser.add_argument("--model", default="Llama 3 8B", help="default model name or id")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--rpm", type=float, default=0, help="requests per minute cap per model, on top of the API's own limits (0 = none)")
+    parser.add_argument("--base-url", default=GROQ_BASE_URL, help="OpenAI-compatible API base URL")
+    parser.add_argument("--api-key", default=os.environ.get("GROQ_API_KEY"), help="defaults to $GROQ_API_KEY")
+    parser.add_argument("--progress-every", type=int, default=10)
+    args = parser.parse_args()
+
+    if not args.api_key and args.base_url == GROQ_BASE_URL:
+        parser.error("an API key is required (--api-key or GROQ_API_KEY)")
+    if find_model(args.model) is None:
+        parser.error(f"unknown model {args.model!r}")
+
+    metrics.start_exporters()
+    counts = asyncio.run(run_batch(args, args.api_key or "local"))
+    if metrics.METRICS_FILE:
+        metrics.REGISTRY.write_file(metrics.METRICS_FILE)  # final numbers, not the last periodic dump
+    exporter = get_trace_exporter()
+    if exporter is not None:
+        exporter.flush()  # the export thread is a daemon and would die with the process
+    print(f"finished: {counts['ok']} ok, {counts['error']} errors, {counts['skipped']} skipped", file=sys.stderr)
+    for model, limiter in sorted(get_rate_limiters(args.base_url).items()):
+        limiter_stats = limiter.stats()
+        print(
+            f"rate limiter {model}: {limiter_stats['throttled']} 429s absorbed, "
+            f"avg wait {limiter_stats['avg_wait']:.2f}s, max wait {limiter_stats['max_wait']:.2f}s",
+            file=sys.stderr
+        )
+    sys.exit(1 if counts["error"] else 0)
+
+if __name__ == "__main__":
+    main()
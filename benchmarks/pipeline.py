@@ -0,0 +1,243 @@
+"""End-to-end benchmark of the chat pipeline against the bundled mock server.
+
+    python benchmarks/pipeline.py --output pipeline.json
+    python benchmarks/pipeline.py --baseline pipeline.json --tolerance 0.25
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+DEFAULT_SIZES = (10, 100, 1000)
+
+def make_history(size: int) -> list:
+    """Alternating user/assistant turns shaped like the app's own messages"""
+    messages = []
+    for i in range(size):
+        role = "user" if i % 2 == 0 else "assistant"
+        words = 12 if role == "user" else 60
+        content = " ".join(f"{role}{i}-word{j}" for j in range(words))
+        messages.append({"role": role, "content": content, "seq": i, "time": "12:00:00"})
+    return messages
+
+def summarize(values: list) -> dict:
+    ordered = sorted(values)
+    return {
+        "samples": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "max": ordered[-1],
+        "mean": statistics.fmean(ordered)
+    }
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _probe(repo_root: str, bench_dir: str, target: str, size: int, repeats: int):
+    """Runs inside AppTest: time one app function with a seeded session"""
+    import random
+    import sys
+    import time
+    import streamlit as st
+    for path in (repo_root, bench_dir):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    import app
+    from history import MessageHistory
+    from pipeline import make_history
+
+    app.initialize_session_state()
+    if not st.session_state.messages:
+        st.session_state.messages = MessageHistory(make_history(size))
+        rng = random.Random(size)
+        for _ in range(size // 2):
+            latency = rng.uniform(0.2, 2.0)
+            app._record_response_stats(
+                "llama3-8b-8192", latency, (rng.randint(50, 2000), rng.randint(20, 800)),
+                ttft=latency * 0.2, tokens_per_second=rng.uniform(200, 800)
+            )
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        if target == "dashboard":
+            app.create_stats_dashboard()
+        else:
+            export_format, _, compress = target.partition("+")
+            app.build_export(export_format, bool(compress))
+        timings.append(time.perf_counter() - start)
+    st.session_state.bench_timings = timings
+
+def run_probe(target: str, size: int, repeats: int) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    app_test = AppTest.from_function(
+        _probe, args=(REPO_ROOT, BENCH_DIR, target, size, repeats), default_timeout=120
+    )
+    app_test.run()
+    if app_test.exception:
+        raise RuntimeError(f"{target} probe raised: {app_test.exception}")
+    return summarize(app_test.session_state["bench_timings"])
+
+def bench_app(size: int, reruns: int, turns: int) -> dict:
+    """Rerun and chat-turn wall time of the full app with `size` messages of history"""
+    from streamlit.testing.v1 import AppTest
+
+    app_test = AppTest.from_file(APP_PATH, default_timeout=120)
+    app_test.session_state["messages"] = make_history(size)
+    app_test.run()
+    provider = next(widget for widget in app_test.selectbox if widget.label == "Provider:")
+    provider.set_value("Local mock").run()
+    if app_test.exception:
+        raise RuntimeError(f"app raised: {app_test.exception}")
+
+    rerun_times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app_test.run()
+        rerun_times.append(time.perf_counter() - start)
+
+    turn_times = []
+    for i in range(turns):
+        start = time.perf_counter()
+        app_test.chat_input[0].set_value(f"benchmark prompt {i}").run()
+        turn_times.append(time.perf_counter() - start)
+        if app_test.exception or app_test.error:
+            raise RuntimeError(f"chat turn failed: {app_test.exception or [e.value for e in app_test.error]}")
+
+    return {"rerun": summarize(rerun_times), "chat_turn": summarize(turn_times)}
+
+def bench_client(base_url: str, requests_count: int) -> dict:
+    """Client-side overhead per request against an instant server"""
+    from groq_client import CompletionStream, request_completion
+
+    messages = [{"role": "user", "content": "benchmark the client"}]
+    blocking, streaming, per_chunk = [], [], []
+    for _ in range(requests_count):
+        result = request_completion("local", messages, "llama3-8b-8192", 0.0, 256, base_url=base_url)
+        blocking.append(result["latency"] - result["usage"].get("total_time", 0.0))
+
+        stream = CompletionStream("local", messages, "llama3-8b-8192", 0.0, 256, base_url=base_url)
+        chunks = sum(1 for _ in stream)
+        overhead = stream.latency - stream.usage.get("total_time", 0.0)
+        streaming.append(overhead)
+        per_chunk.append(overhead / max(chunks, 1))
+    return {
+        "blocking": summarize(blocking),
+        "streaming": summarize(streaming),
+        "streaming_per_chunk": summarize(per_chunk)
+    }
+
+def flatten_medians(results: dict, prefix: str = "") -> dict:
+    """{"rerun/100": median, ...} for every summary in a results tree"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}/{key}" if prefix else str(key)
+        if isinstance(value, dict) and "median" in value:
+            flat[path] = value["median"]
+        elif isinstance(value, dict):
+            flat.update(flatten_medians(value, path))
+    return flat
+
+def find_regressions(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    current = flatten_medians(results)
+    previous = flatten_medians(baseline.get("results", {}))
+    regressions = []
+    for path, median in sorted(current.items()):
+        before = previous.get(path)
+        # Sub-millisecond metrics jitter by more than the tolerance; ignore changes below min_delta
+        if before and median > before * (1 + tolerance) and median - before > min_delta:
+            regressions.append({"metric": path, "baseline": before, "current": median, "ratio": median / before})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="history sizes in messages")
+    parser.add_argument("--reruns", type=int, default=10, help="timed reruns per history size")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per history size")
+    parser.add_argument("--repeats", type=int, default=5, help="calls per export/dashboard measurement")
+    parser.add_argument("--requests", type=int, default=50, help="requests for the client overhead measurement")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier --output file to compare medians against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a metric is flagged")
+    parser.add_argument("--min-delta", type=float, default=0.001, help="ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    # Point the app at the mock and keep its SQLite files out of the working tree,
+    # before anything imports groq_client or app
+    port = _free_port()
+    os.environ["MOCK_LLM_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ["SESSION_DB_PATH"] = os.path.join(workdir.name, "sessions.db")
+    os.environ.pop("RESPONSE_CACHE_DB", None)
+    sys.path.insert(0, REPO_ROOT)
+
+    from mock_server import MockConfig, MockLLMServer
+    import streamlit
+
+    server = MockLLMServer(port=port, config=MockConfig(response_tokens=128)).start()
+    results = {"rerun": {}, "chat_turn": {}, "export": {}, "dashboard": {}}
+    try:
+        for size in args.sizes:
+            print(f"history {size}...", file=sys.stderr)
+            app_results = bench_app(size, args.reruns, args.turns)
+            results["rerun"][str(size)] = app_results["rerun"]
+            results["chat_turn"][str(size)] = app_results["chat_turn"]
+            results["export"][str(size)] = {
+                f"{export_format}{suffix}": run_probe(f"{export_format}{suffix}", size, args.repeats)
+                for export_format in ("JSON", "NDJSON", "Text")
+                for suffix in ("", "+gzip")
+            }
+            results["dashboard"][str(size)] = run_probe("dashboard", size, args.repeats)
+        print("client overhead...", file=sys.stderr)
+        results["client"] = bench_client(server.base_url, args.requests)
+    finally:
+        server.stop()
+        workdir.cleanup()
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "streamlit": streamlit.__version__,
+        "platform": platform.platform(),
+        "config": {
+            "sizes": args.sizes,
+            "reruns": args.reruns,
+            "turns": args.turns,
+            "repeats": args.repeats,
+            "requests": args.requests
+        },
+        "results": results
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance, args.min_delta)
+        report["regressions"] = regressions
+        for item in regressions:
+            print(f"REGRESSION {item['metric']}: {item['baseline'] * 1000:.2f}ms -> "
+                  f"{item['current'] * 1000:.2f}ms ({item['ratio']:.2f}x)", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
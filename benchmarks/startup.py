@@ -0,0 +1,94 @@
+"""Cold-start and per-rerun wall time benchmark for app.py.
+
+    python benchmarks/startup.py --runs 5 --reruns 20 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+def measure_once(reruns: int) -> dict:
+    """Run inside a fresh interpreter and return timings in seconds"""
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    import_streamlit = time.perf_counter() - start
+
+    app = AppTest.from_file(APP_PATH, default_timeout=60)
+    start = time.perf_counter()
+    app.run()
+    first_run = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(f"app raised during first run: {app.exception}")
+
+    rerun_times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app.run()
+        rerun_times.append(time.perf_counter() - start)
+
+    return {
+        "import_streamlit": import_streamlit,
+        "first_run": first_run,
+        "reruns": rerun_times,
+        "heavy_modules_loaded": sorted(m for m in ("numpy", "pandas", "plotly.express") if m in sys.modules)
+    }
+
+def summarize(values: list) -> dict:
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "max": max(values)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh-interpreter samples")
+    parser.add_argument("--reruns", type=int, default=20, help="warm reruns per sample")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_once(args.reruns)))
+        return
+
+    samples = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Keep the app's SQLite files out of the working tree
+        env = dict(os.environ, SESSION_DB_PATH=os.path.join(workdir, "sessions.db"))
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", "--reruns", str(args.reruns)],
+                capture_output=True, text=True, check=True, cwd=workdir, env=env
+            )
+            sample = json.loads(result.stdout.strip().splitlines()[-1])
+            sample["process_total"] = time.perf_counter() - start
+            samples.append(sample)
+
+    report = {
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "reruns_per_run": args.reruns,
+        "import_streamlit": summarize([s["import_streamlit"] for s in samples]),
+        "first_run": summarize([s["first_run"] for s in samples]),
+        "rerun": summarize([t for s in samples for t in s["reruns"]]),
+        "process_total": summarize([s["process_total"] for s in samples]),
+        "heavy_modules_loaded": samples[-1]["heavy_modules_loaded"]
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
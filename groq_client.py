@@ -0,0 +1,1349 @@
+"""UI-free client core for the Groq chat completions API and other OpenAI-compatible endpoints"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import os
+import re
+import json
+import time
+import heapq
+import socket
+import hashlib
+import itertools
+import threading
+import contextvars
+from collections import deque
+from typing import Optional, Dict, List, Sequence, Tuple
+
+from metrics import LLM_DEDUPLICATED, LLM_HEDGES, LLM_INFLIGHT, LLM_STOPPED, LLM_THROTTLED, observe_request
+from tracing import current_trace, record_server_timing, span
+
+def get_model_info():
+    """Extended model information with pricing and capabilities"""
+    return {
+        "Llama 3 70B": {
+            "id": "llama3-70b-8192",
+            "description": "Meta's most capable Llama 3 model",
+            "context": "8K tokens",
+            "context_tokens": 8192,
+            "price": "Free",
+            "category": "Premium"
+        },
+        "Llama 3 8B": {
+            "id": "llama3-8b-8192",
+            "description": "Fast and efficient Llama 3 model",
+            "context": "8K tokens",
+            "context_tokens": 8192,
+            "price": "Free",
+            "category": "Standard"
+        },
+        "Mixtral 8x7B": {
+            "id": "mixtral-8x7b-32768",
+            "description": "High-quality mixture of experts model",
+            "context": "32K tokens",
+            "context_tokens": 32768,
+            "price": "Free",
+            "category": "Premium"
+        },
+        "Gemma 7B": {
+            "id": "gemma-7b-it",
+            "description": "Google's lightweight model",
+            "context": "8K tokens",
+            "context_tokens": 8192,
+            "price": "Free",
+            "category": "Economy"
+        }
+    }
+
+def get_providers():
+    """OpenAI-compatible chat backends, keyed by display name"""
+    providers = {
+        "Groq": {
+            "base_url": GROQ_BASE_URL,
+            "requires_key": True,
+            "description": "Groq cloud inference on LPUs"
+        },
+        "Local mock": {
+            "base_url": MOCK_BASE_URL,
+            "requires_key": False,
+            "description": "Bundled mock_server.py for offline and load testing"
+        }
+    }
+    if CUSTOM_BASE_URL:
+        providers["Custom"] = {
+            "base_url": CUSTOM_BASE_URL,
+            "requires_key": False,
+            "description": "Endpoint from $LLM_BASE_URL"
+        }
+    return providers
+
+def chat_completions_url(base_url: Optional[str] = None) -> str:
+    return (base_url or GROQ_BASE_URL).rstrip("/") + "/chat/completions"
+
+def find_model(name_or_id: str) -> Optional[Dict]:
+    """Catalog entry by display name or model id"""
+    for name, info in get_model_info().items():
+        if name_or_id in (name, info["id"]):
+            return dict(info, name=name)
+    return None
+
+# OpenAI-compatible base URLs; requests go to {base_url}/chat/completions
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+MOCK_BASE_URL = os.environ.get("MOCK_LLM_URL", "http://127.0.0.1:8400/v1")
+CUSTOM_BASE_URL = os.environ.get("LLM_BASE_URL", "")
+
+# HTTP client tuning, overridable through the environment
+HTTP_POOL_SIZE = int(os.environ.get("GROQ_HTTP_POOL_SIZE", "10"))
+HTTP_MAX_RETRIES = int(os.environ.get("GROQ_HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("GROQ_HTTP_BACKOFF_FACTOR", "0.5"))
+# 429s are left to the RateLimiter, which honours Retry-After for every caller at once
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+_sessions: Dict[bool, requests.Session] = {}
+_session_lock = threading.Lock()
+
+def get_http_session(retry_status: bool = True) -> requests.Session:
+    """Process-wide keep-alive session; retry_status=False hands 5xx straight back, for callers with a fallback"""
+    with _session_lock:
+        session = _sessions.get(retry_status)
+        if session is None:
+            session = _sessions[retry_status] = _build_http_session(retry_status)
+        return session
+
+def _build_http_session(retry_status: bool = True) -> requests.Session:
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        read=0,  # a read failure may mean the completion already ran; don't pay for it twice
+        status=None if retry_status else 0,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["POST"]),
+        # Retry-After would make urllib3 retry 429s on its own; the RateLimiter handles them instead
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_pool_stats() -> Dict[str, int]:
+    """Connection pool statistics summed over the shared HTTP sessions"""
+    with _session_lock:
+        sessions = list(_sessions.values())
+    stats = {"hosts": 0, "connections_opened": 0, "requests": 0, "idle_connections": 0}
+    for session in sessions:
+        pools = session.get_adapter(GROQ_BASE_URL).poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            if pool is None:
+                continue
+            stats["hosts"] += 1
+            stats["connections_opened"] += pool.num_connections
+            stats["requests"] += pool.num_requests
+            # Empty slots in the queue are None placeholders, not live sockets
+            stats["idle_connections"] += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+    return stats
+
+def request_cache_key(model: str, messages: List[Dict], temperature: float, max_tokens: int,
+                      base_url: Optional[str] = None) -> str:
+    """Canonical hash of everything that determines a completion"""
+    canonical = json.dumps(
+        {
+            "endpoint": chat_completions_url(base_url),
+            "model": model,
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+            "temperature": round(float(temperature), 4),
+            "max_tokens": int(max_tokens)
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _build_headers(api_key: str) -> Dict[str, str]:
+    """Request headers for an OpenAI-compatible API"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+
+class GroqAPIError(Exception):
+    """Non-200 response from the Groq API"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+def _api_error(response) -> GroqAPIError:
+    """Build a GroqAPIError from a failed response"""
+    try:
+        detail = response.json().get("error", {}).get("message", response.text)
+    except ValueError:
+        detail = response.text
+    return GroqAPIError(response.status_code, detail)
+
+# Client-side rate limiting. Limits of 0 mean "unknown": they are learned from
+# the x-ratelimit-* response headers, and 429s are always honoured.
+RATE_LIMIT_RPM = float(os.environ.get("GROQ_RPM_LIMIT", "0"))
+RATE_LIMIT_TPM = float(os.environ.get("GROQ_TPM_LIMIT", "0"))
+RATE_LIMIT_RETRIES = int(os.environ.get("GROQ_RATE_LIMIT_RETRIES", "4"))
+RATE_LIMIT_BASE_BACKOFF = 1.0
+RATE_LIMIT_MIN_SCALE = 0.1
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds from a rate-limit reset header such as "2m59.56s", "7.66s" or "120ms" """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def _header_number(headers, name: str) -> Optional[float]:
+    value = headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class _Bucket:
+    """Token bucket refilled continuously at capacity per minute (capacity 0 = unlimited)"""
+
+    __slots__ = ("capacity", "level", "updated", "blocked_until")
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now: float, scale: float):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0 * scale)
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float, scale: float) -> float:
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if not self.capacity:
+            return 0.0
+        cost = min(cost, self.capacity)
+        if self.level >= cost:
+            return 0.0
+        return (cost - self.level) / (self.capacity / 60.0 * scale)
+
+    def take(self, cost: float):
+        if self.capacity:
+            self.level -= min(cost, self.capacity)
+
+class RateLimiter:
+    """Process-wide limiter on requests/min and tokens/min for one model, fair across clients"""
+
+    def __init__(self, requests_per_minute: float = RATE_LIMIT_RPM, tokens_per_minute: float = RATE_LIMIT_TPM):
+        self._cond = threading.Condition()
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._scale = 1.0
+        self._consecutive_throttles = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0
+        self._client_finish: Dict[str, int] = {}
+        self.granted = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def configure(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        with self._cond:
+            if requests_per_minute is not None:
+                self._requests = _Bucket(requests_per_minute)
+            if tokens_per_minute is not None:
+                self._tokens = _Bucket(tokens_per_minute)
+            self._cond.notify_all()
+
+    def acquire(self, tokens: float = 0, client: str = "default") -> float:
+        """Block until a request costing `tokens` may be sent; returns the seconds waited"""
+        start = time.monotonic()
+        with self._cond:
+            start_tag = max(self._virtual_time, self._client_finish.get(client, 0))
+            self._client_finish[client] = start_tag + 1
+            entry = (start_tag, next(self._sequence))
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    if self._queue[0] != entry:
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    self._requests.refill(now, self._scale)
+                    self._tokens.refill(now, self._scale)
+                    wait = max(
+                        self._requests.wait_time(1, now, self._scale),
+                        self._tokens.wait_time(tokens, now, self._scale)
+                    )
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._queue)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self._virtual_time = start_tag
+            if len(self._client_finish) > 1000:
+                self._client_finish = {c: f for c, f in self._client_finish.items() if f > self._virtual_time}
+
+            waited = time.monotonic() - start
+            self.granted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self._cond.notify_all()
+        return waited
+
+    def settle(self, estimated_tokens: float, actual_tokens: float):
+        """Charge the difference once the real token usage is known"""
+        with self._cond:
+            self._tokens.take(actual_tokens - estimated_tokens)
+
+    def observe(self, headers):
+        """Sync the buckets with the server's view from the x-ratelimit-* headers"""
+        now = time.monotonic()
+        with self._cond:
+            limit_tokens = _header_number(headers, "x-ratelimit-limit-tokens")
+            if limit_tokens:
+                if not self._tokens.capacity:
+                    # First sighting of the limit: start full, the remaining count trims it below
+                    self._tokens.level = limit_tokens
+                self._tokens.capacity = limit_tokens
+
+            # The request limit Groq reports is per day, so only its remaining count is used
+            for bucket, dimension in ((self._tokens, "tokens"), (self._requests, "requests")):
+                remaining = _header_number(headers, f"x-ratelimit-remaining-{dimension}")
+                if remaining is None:
+                    continue
+                if bucket.capacity:
+                    bucket.refill(now, self._scale)
+                    bucket.level = min(bucket.level, remaining)
+                if remaining < 1:
+                    reset = _parse_duration(headers.get(f"x-ratelimit-reset-{dimension}"))
+                    if reset:
+                        bucket.blocked_until = max(bucket.blocked_until, now + reset)
+            self._cond.notify_all()
+
+    def backoff(self, retry_after: Optional[float] = None):
+        """A 429 came back: pause every caller and slow the refill rate"""
+        now = time.monotonic()
+        with self._cond:
+            self.throttled += 1
+            self._consecutive_throttles += 1
+            self._scale = max(RATE_LIMIT_MIN_SCALE, self._scale * 0.5)
+            delay = retry_after or RATE_LIMIT_BASE_BACKOFF * 2 ** min(self._consecutive_throttles - 1, 5)
+            for bucket in (self._requests, self._tokens):
+                bucket.blocked_until = max(bucket.blocked_until, now + delay)
+            self._cond.notify_all()
+
+    def record_success(self):
+        with self._cond:
+            self._consecutive_throttles = 0
+            self._scale = min(1.0, self._scale + 0.1)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "queue_depth": len(self._queue),
+                "granted": self.granted,
+                "throttled": self.throttled,
+                "avg_wait": self.total_wait / self.granted if self.granted else 0.0,
+                "max_wait": self.max_wait,
+                "rate_scale": self._scale,
+                "blocked_for": max(0.0, self._requests.blocked_until - now, self._tokens.blocked_until - now),
+                "tokens_per_minute": self._tokens.capacity,
+                "tokens_available": max(0.0, self._tokens.level) if self._tokens.capacity else None
+            }
+
+_rate_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_rate_limit_overrides: Dict[str, Dict[str, float]] = {}
+
+def get_rate_limiter(base_url: Optional[str] = None, model: str = "") -> RateLimiter:
+    """Process-wide rate limiter for one model on one endpoint, shared by every session and thread"""
+    url = chat_completions_url(base_url)
+    with _session_lock:
+        limiter = _rate_limiters.get((url, model))
+        if limiter is None:
+            limiter = _rate_limiters[(url, model)] = RateLimiter(**_rate_limit_overrides.get(url, {}))
+        return limiter
+
+def get_rate_limiters(base_url: Optional[str] = None) -> Dict[str, RateLimiter]:
+    """The limiters created so far for an endpoint, by model"""
+    url = chat_completions_url(base_url)
+    with _session_lock:
+        return {model: limiter for (limiter_url, model), limiter in _rate_limiters.items() if limiter_url == url}
+
+def configure_rate_limits(base_url: Optional[str] = None, requests_per_minute: Optional[float] = None,
+                          tokens_per_minute: Optional[float] = None):
+    """Set the budgets of every model's limiter on an endpoint, including limiters created later"""
+    url = chat_completions_url(base_url)
+    overrides = {"requests_per_minute": requests_per_minute, "tokens_per_minute": tokens_per_minute}
+    overrides = {name: value for name, value in overrides.items() if value is not None}
+    with _session_lock:
+        _rate_limit_overrides.setdefault(url, {}).update(overrides)
+    for limiter in get_rate_limiters(base_url).values():
+        limiter.configure(requests_per_minute, tokens_per_minute)
+
+def _estimate_request_tokens(messages: List[Dict]) -> int:
+    """Cheap prompt-size estimate (about four characters per token) for budgeting"""
+    return sum(len(m["content"]) for m in messages) // 4 + 4 * len(messages)
+
+def _connections_opened(session: requests.Session, url: str) -> int:
+    """Connections the session's pools have opened so far"""
+    pools = session.get_adapter(url).poolmanager.pools
+    return sum(pools[key].num_connections for key in pools.keys() if pools[key] is not None)
+
+def _post_chat(session: requests.Session, api_key: str, data: Dict, stream: bool, client: str,
+               base_url: Optional[str], rate_limit_retries: Optional[int] = None):
+    """POST a chat request through the shared rate limiter; returns (response, estimated_tokens)"""
+    retries = RATE_LIMIT_RETRIES if rate_limit_retries is None else rate_limit_retries
+    limiter = get_rate_limiter(base_url, data["model"])
+    url = chat_completions_url(base_url)
+    estimated_tokens = _estimate_request_tokens(data["messages"])
+    with span("serialize") as serialize_span:
+        # Encoded once up front so retries reuse it and the cost shows up in traces
+        body = json.dumps(data).encode("utf-8")
+        serialize_span.set(bytes=len(body))
+    for attempt in range(retries + 1):
+        with span("rate_limit"):
+            limiter.acquire(estimated_tokens, client)
+        with span("http", url=url, attempt=attempt, stream=stream) as http_span:
+            if http_span.recording:
+                connections_before = _connections_opened(session, url)
+            response = session.post(
+                url,
+                headers=_build_headers(api_key),
+                data=body,
+                timeout=60,
+                stream=stream
+            )
+            if http_span.recording:
+                # requests can't split DNS/connect/TLS out; flag when they were paid on this call
+                http_span.set(
+                    status=response.status_code,
+                    new_connection=_connections_opened(session, url) > connections_before,
+                    headers_ms=round(response.elapsed.total_seconds() * 1000, 3)
+                )
+        limiter.observe(response.headers)
+        if response.status_code != 429 or attempt == retries:
+            if response.status_code == 200:
+                limiter.record_success()
+            return response, estimated_tokens
+        LLM_THROTTLED.inc()
+        limiter.backoff(_parse_duration(response.headers.get("retry-after")))
+        response.close()
+
+# Live per-model health for the "Auto" model choice
+ROUTER_ALPHA = 0.2  # EWMA weight of the newest sample
+ROUTER_COOLDOWN = float(os.environ.get("GROQ_ROUTER_COOLDOWN", "30"))
+ROUTER_PRIOR_LATENCY = 1.5  # assumed for models without samples, so each gets tried
+ROUTER_MAX_ERROR_RATE = 0.5
+
+class _ModelHealth:
+    __slots__ = ("latency", "deviation", "error_rate", "samples", "cooldown_until", "last_status")
+
+    def __init__(self):
+        self.latency = None
+        self.deviation = 0.0
+        self.error_rate = 0.0
+        self.samples = 0
+        self.cooldown_until = 0.0
+        self.last_status = None
+
+class ModelRouter:
+    """Ranks models by live latency and health, for routing prompts automatically"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, _ModelHealth] = {}
+
+    def record(self, model: str, status: str, latency: Optional[float] = None):
+        failed = status in ("429", "network_error") or status[:1] == "5"
+        if status != "ok" and not failed:
+            return  # cancelled, or a client error
+        with self._lock:
+            health = self._models.setdefault(model, _ModelHealth())
+            health.last_status = status
+            health.error_rate += ROUTER_ALPHA * (float(failed) - health.error_rate)
+            if failed:
+                health.cooldown_until = time.monotonic() + ROUTER_COOLDOWN
+                return
+            if latency is None:
+                return
+            health.samples += 1
+            if health.latency is None:
+                health.latency = latency
+                health.deviation = latency / 2
+            else:
+                health.deviation += ROUTER_ALPHA * (abs(latency - health.latency) - health.deviation)
+                health.latency += ROUTER_ALPHA * (latency - health.latency)
+
+    def _score(self, health: Optional[_ModelHealth]) -> float:
+        if health is None or health.latency is None:
+            return ROUTER_PRIOR_LATENCY
+        return health.latency + 2 * health.deviation
+
+    def _healthy(self, health: Optional[_ModelHealth], now: float) -> bool:
+        return health is None or (health.cooldown_until <= now and health.error_rate < ROUTER_MAX_ERROR_RATE)
+
+    def rank(self, context_limits: Dict[str, int], required_tokens: int) -> List[str]:
+        """Models fastest first: healthy ones that fit, then unhealthy ones that fit, then the rest by context size"""
+        now = time.monotonic()
+        with self._lock:
+            def key(model):
+                health = self._models.get(model)
+                fits = context_limits[model] >= required_tokens
+                return (not fits, not self._healthy(health, now), -context_limits[model] if not fits else 0,
+                        self._score(health))
+            return sorted(context_limits, key=key)
+
+    def stats(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "latency": health.latency,
+                    "tail": self._score(health) if health.latency is not None else None,
+                    "error_rate": health.error_rate,
+                    "samples": health.samples,
+                    "cooldown": max(0.0, health.cooldown_until - now),
+                    "healthy": self._healthy(health, now),
+                    "last_status": health.last_status
+                }
+                for model, health in self._models.items()
+            }
+
+_model_router = ModelRouter()
+
+def get_model_router() -> ModelRouter:
+    return _model_router
+
+# Hedged requests: a duplicate for a response slower than the model's usual tail
+HEDGE_ENABLED = os.environ.get("GROQ_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("GROQ_HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET = float(os.environ.get("GROQ_HEDGE_BUDGET", "0.05"))  # extra requests allowed per request
+HEDGE_BURST = 2.0  # hedges that may fire back to back after a quiet spell
+HEDGE_DEFAULT_DELAY = float(os.environ.get("GROQ_HEDGE_DELAY", "2.0"))  # until a model has enough samples
+HEDGE_MIN_DELAY = 0.2
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+
+class Hedger:
+    """When to send a duplicate request, and whether the budget allows one"""
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, budget: float = HEDGE_BUDGET):
+        self.percentile = percentile
+        self.budget = budget
+        self._samples: Dict[Tuple[str, str], deque] = {}
+        self._tokens = HEDGE_BURST
+        self._lock = threading.Lock()
+
+    def record(self, model: str, kind: str, seconds: float):
+        """Time of a successful call; kind is "ttft" for streams, "latency" for blocking calls"""
+        with self._lock:
+            samples = self._samples.get((model, kind))
+            if samples is None:
+                samples = self._samples[(model, kind)] = deque(maxlen=HEDGE_WINDOW)
+            samples.append(seconds)
+
+    def delay(self, model: str, kind: str) -> float:
+        with self._lock:
+            samples = sorted(self._samples.get((model, kind), ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        rank = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(HEDGE_MIN_DELAY, samples[rank])
+
+    def earn(self):
+        """Credit the budget for one request sent"""
+        with self._lock:
+            self._tokens = min(HEDGE_BURST, self._tokens + self.budget)
+
+    def acquire(self) -> bool:
+        """Spend budget on one hedge; False (and counted as denied) when there isn't enough"""
+        with self._lock:
+            allowed = self._tokens >= 1
+            if allowed:
+                self._tokens -= 1
+        LLM_HEDGES.inc(event="fired" if allowed else "denied")
+        return allowed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            keys = list(self._samples)
+            budget_left = self._tokens
+        return {
+            "budget_left": budget_left,
+            "delays": {f"{model} {kind}": self.delay(model, kind) for model, kind in keys}
+        }
+
+_hedger = Hedger()
+
+def get_hedger() -> Hedger:
+    return _hedger
+
+def _observe(model: str, status: str, latency: Optional[float] = None, usage: Optional[Dict] = None,
+             ttft: Optional[float] = None):
+    """Report a finished call to the metrics registry, the model router and the hedger"""
+    observe_request(model, status, latency, usage, ttft)
+    _model_router.record(model, status, latency)
+    if status == "ok":
+        if ttft is not None:
+            _hedger.record(model, "ttft", ttft)
+        elif latency is not None:
+            _hedger.record(model, "latency", latency)
+
+def request_completion(api_key: str, messages, model: str, temperature: float, max_tokens: int,
+                       session: Optional[requests.Session] = None, client: str = "default",
+                       base_url: Optional[str] = None, rate_limit_retries: Optional[int] = None,
+                       deduplicate: bool = True) -> Dict:
+    """Blocking chat completion without any UI side effects, safe to call from worker threads"""
+    def fetch():
+        return _request_completion(api_key, messages, model, temperature, max_tokens, session, client, base_url,
+                                   rate_limit_retries)
+
+    if not (SINGLE_FLIGHT_ENABLED and deduplicate):
+        return fetch()
+    start_time = time.time()
+    key = single_flight_key(api_key, model, messages, temperature, max_tokens, base_url)
+    result, shared = get_single_flight().do(key, fetch)
+    if not shared:
+        return result
+    return dict(result, latency=time.time() - start_time, shared=True)
+
+def _request_completion(api_key: str, messages, model: str, temperature: float, max_tokens: int,
+                        session: Optional[requests.Session], client: str, base_url: Optional[str],
+                        rate_limit_retries: Optional[int]) -> Dict:
+    start_time = time.time()
+    session = session or get_http_session()
+
+    data = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": False
+    }
+
+    LLM_INFLIGHT.inc()
+    try:
+        response, estimated_tokens = _post_chat(session, api_key, data, False, client, base_url, rate_limit_retries)
+    except requests.exceptions.RequestException:
+        _observe(model, "network_error")
+        raise
+    finally:
+        LLM_INFLIGHT.dec()
+
+    if response.status_code != 200:
+        _observe(model, str(response.status_code))
+        raise _api_error(response)
+
+    with span("parse"):
+        result = response.json()
+        content = result["choices"][0]["message"]["content"]
+    usage = result.get("usage") or {}
+    record_server_timing(usage)
+    if usage.get("total_tokens"):
+        get_rate_limiter(base_url, model).settle(estimated_tokens, usage["total_tokens"])
+    latency = time.time() - start_time
+    _observe(model, "ok", latency, usage)
+    return {
+        "model": model,
+        "content": content,
+        "usage": usage,
+        "latency": latency
+    }
+
+class _StreamTimings:
+    """content, ttft and latency of a stream, from its start/first token/end times and parts"""
+
+    start_time: float
+    first_token_time: Optional[float]
+    end_time: Optional[float]
+    _parts: List[str]
+
+    @property
+    def content(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def ttft(self) -> Optional[float]:
+        if self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    @property
+    def generation_time(self) -> Optional[float]:
+        """Seconds from the first token to the end of the stream"""
+        if self.end_time is None or self.first_token_time is None:
+            return None
+        return self.end_time - self.first_token_time
+
+class CompletionStream(_StreamTimings):
+    """Iterator over the text deltas of a streamed chat completion"""
+
+    def __init__(self, api_key: str, messages, model: str, temperature: float, max_tokens: int,
+                 session: Optional[requests.Session] = None, client: str = "default",
+                 base_url: Optional[str] = None, rate_limit_retries: Optional[int] = None):
+        self.model = model
+        self.base_url = base_url
+        self.usage: Dict = {}
+        self.start_time = time.time()
+        self.first_token_time = None
+        self.end_time = None
+        self._parts: List[str] = []
+        self._cancelled = False
+        # Captured here because iteration may happen outside the caller's context
+        self._trace = current_trace()
+
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+
+        LLM_INFLIGHT.inc()
+        self._in_flight = True
+        try:
+            response, self._estimated_tokens = _post_chat(
+                session or get_http_session(), api_key, data, True, client, base_url, rate_limit_retries
+            )
+        except requests.exceptions.RequestException:
+            self._finish("network_error")
+            raise
+
+        if response.status_code != 200:
+            self._finish(str(response.status_code))
+            raise _api_error(response)
+        self._response = response
+
+    def _finish(self, status: str):
+        """Report the outcome to the metrics registry, once"""
+        if not self._in_flight:
+            return
+        self._in_flight = False
+        LLM_INFLIGHT.dec()
+        if status == "ok":
+            _observe(self.model, status, self.latency, self.usage, self.ttft)
+        else:
+            _observe(self.model, status)
+
+    def __iter__(self):
+        stream_start = time.time_ns()
+        chunks = 0
+        parse_time = 0.0
+        # Time spent in this generator, as opposed to the consumer between deltas
+        client_time = 0.0
+        resumed = time.perf_counter()
+        try:
+            with self._response as response:
+                for raw_line in response.iter_lines():
+                    # SSE frames look like "data: {...}"; blank lines separate events
+                    line = raw_line.decode("utf-8")
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+
+                    parse_start = time.perf_counter()
+                    chunk = json.loads(payload)
+                    parse_time += time.perf_counter() - parse_start
+                    chunks += 1
+                    # Groq reports usage on the final chunk under "x_groq"
+                    self.usage = chunk.get("usage") or chunk.get("x_groq", {}).get("usage") or self.usage
+
+                    choices = chunk.get("choices") or []
+                    delta = choices[0].get("delta", {}).get("content") if choices else None
+                    if delta:
+                        if self.first_token_time is None:
+                            self.first_token_time = time.time()
+                        self._parts.append(delta)
+                        client_time += time.perf_counter() - resumed
+                        yield delta
+                        resumed = time.perf_counter()
+            client_time += time.perf_counter() - resumed
+            self.end_time = time.time()
+            if self._trace is not None:
+                stream_span = self._trace.start_span(
+                    "stream", start_ns=stream_start,
+                    chunks=chunks,
+                    parse_ms=round(parse_time * 1000, 3),
+                    client_ms=round(client_time * 1000, 3)
+                )
+                stream_span.end_ns = time.time_ns()
+                record_server_timing(self.usage, self._trace, stream_span.end_ns)
+            if self.usage.get("total_tokens"):
+                get_rate_limiter(self.base_url, self.model).settle(self._estimated_tokens, self.usage["total_tokens"])
+            self._finish("ok")
+        except Exception as e:
+            if self._cancelled:
+                return  # close() broke the read from another thread: a cancel, not a failure
+            if isinstance(e, requests.exceptions.RequestException):
+                self._finish("network_error")
+            raise
+        finally:
+            self._finish("cancelled")  # no-op unless the consumer stopped early
+
+    def close(self):
+        # Settle as cancelled before touching the socket, so the reader it
+        # wakes can't report the broken read as a network error first
+        self._cancelled = True
+        self._finish("cancelled")
+        # Shut the socket down: that wakes a read blocked in another thread,
+        # which closing alone would leave waiting for the next chunk
+        connection = getattr(self._response.raw, "_connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._response.close()
+
+
+# Single-flight: concurrent identical requests (double-submits, several tabs or
+# batch jobs asking the same thing) share one upstream call. Joining happens
+# at any temperature; a caller that wants an independent sample can vary the
+# prompt or disable this with GROQ_SINGLE_FLIGHT=0.
+SINGLE_FLIGHT_ENABLED = os.environ.get("GROQ_SINGLE_FLIGHT", "1") != "0"
+
+def single_flight_key(api_key: str, model: str, messages: List[Dict], temperature: float, max_tokens: int,
+                      base_url: Optional[str] = None) -> str:
+    """request_cache_key plus a digest of the API key, so callers never share another key's quota"""
+    key_digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return f"{request_cache_key(model, messages, temperature, max_tokens, base_url)}:{key_digest}"
+
+class _Flight:
+    """Outcome of one blocking call, published to the callers waiting on it"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+class SharedStream:
+    """Buffered deltas of one upstream CompletionStream, readable by several callers"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.ready = threading.Event()  # set once the upstream request has been answered
+        self.on_done = None
+        self._cond = threading.Condition()
+        self._parts: List[str] = []
+        self._upstream: Optional[CompletionStream] = None
+        self._iterator = None
+        self._readers = 0
+        self._reading = False
+        self._done = False
+        self._abandoned = False
+        self._error: Optional[BaseException] = None
+
+    def open(self, factory):
+        """Send the upstream request; errors are kept for the readers waiting on ready"""
+        try:
+            self._upstream = factory()
+            self._iterator = iter(self._upstream)
+        except BaseException as e:
+            self._end(e)
+            raise
+        finally:
+            self.ready.set()
+
+    def join(self):
+        """Wait for the upstream response and raise the leader's error if it failed"""
+        self.ready.wait()
+        if self._upstream is None:
+            raise self._error
+
+    @property
+    def usage(self) -> Dict:
+        return self._upstream.usage if self._upstream is not None else {}
+
+    def attach(self, shared: bool) -> Optional["StreamReader"]:
+        """New reader, or None if the last reader already gave up on this stream"""
+        with self._cond:
+            if self._abandoned:
+                return None
+            self._readers += 1
+        return StreamReader(self, shared)
+
+    def detach(self):
+        with self._cond:
+            self._readers -= 1
+            abandon = self._readers == 0 and not self._done
+            if abandon:
+                self._abandoned = True
+        if abandon:
+            if self._upstream is not None:
+                self._upstream.close()
+            self._end(None)
+
+    def part(self, index: int) -> Optional[str]:
+        """Delta number index, fetching it if no reader has yet; None past the end"""
+        while True:
+            with self._cond:
+                if index < len(self._parts):
+                    return self._parts[index]
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return None
+                if self._reading:
+                    self._cond.wait()
+                    continue
+                self._reading = True
+            try:
+                delta = next(self._iterator)
+            except StopIteration:
+                self._end(None)
+            except BaseException as e:
+                self._end(e)
+                raise
+            else:
+                with self._cond:
+                    self._parts.append(delta)
+                    self._reading = False
+                    self._cond.notify_all()
+
+    def _end(self, error: Optional[BaseException]):
+        with self._cond:
+            if self._done:
+                return
+            self._done = True
+            self._reading = False
+            self._error = error
+            self._cond.notify_all()
+        if self.on_done is not None:
+            self.on_done()
+
+class StreamReader(_StreamTimings):
+    """One caller's iterator over a SharedStream, with its own ttft and latency"""
+
+    def __init__(self, stream: SharedStream, shared: bool):
+        self.model = stream.model
+        self.shared = shared
+        self.start_time = time.time()
+        self.first_token_time = None
+        self.end_time = None
+        self._parts: List[str] = []
+        self._stream = stream
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    @property
+    def usage(self) -> Dict:
+        return self._stream.usage
+
+    def __iter__(self):
+        index = 0
+        try:
+            while True:
+                delta = self._stream.part(index)
+                if delta is None:
+                    break
+                index += 1
+                if self.first_token_time is None:
+                    self.first_token_time = time.time()
+                self._parts.append(delta)
+                yield delta
+            self.end_time = time.time()
+        finally:
+            self.close()
+
+    def close(self):
+        # May be called from another thread to cancel, racing the generator's own close
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stream.detach()
+
+class SingleFlight:
+    """Registry of in-flight requests keyed by single_flight_key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, SharedStream] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: str, fn):
+        """Run fn, or wait for the identical call already running; returns (result, shared)"""
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            LLM_DEDUPLICATED.inc(mode="blocking")
+            with span("single_flight", role="follower"):
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+        return flight.result, False
+
+    def stream(self, key: str, model: str, factory) -> StreamReader:
+        """Reader over the identical stream in flight, or over a new one opened with factory()"""
+        with self._lock:
+            stream = self._streams.get(key)
+            reader = stream.attach(True) if stream is not None else None
+            leader = reader is None
+            if leader:
+                stream = self._streams[key] = SharedStream(model)
+                stream.on_done = lambda: self._release(key, stream)
+                reader = stream.attach(False)
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if leader:
+            stream.open(factory)
+            return reader
+        LLM_DEDUPLICATED.inc(mode="stream")
+        try:
+            with span("single_flight", role="follower"):
+                stream.join()
+        except BaseException:
+            reader.close()
+            raise
+        return reader
+
+    def _release(self, key: str, stream: SharedStream):
+        with self._lock:
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "in_flight": len(self._calls) + len(self._streams)
+            }
+
+_single_flight = SingleFlight()
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
+
+def open_stream(api_key: str, messages, model: str, temperature: float, max_tokens: int,
+                session: Optional[requests.Session] = None, client: str = "default",
+                base_url: Optional[str] = None, rate_limit_retries: Optional[int] = None,
+                deduplicate: bool = True) -> StreamReader:
+    """Streamed completion that joins an identical stream already in flight, unless deduplicate is off"""
+    def factory():
+        return CompletionStream(api_key, messages, model, temperature, max_tokens, session, client, base_url,
+                                rate_limit_retries)
+
+    if not (SINGLE_FLIGHT_ENABLED and deduplicate):
+        stream = SharedStream(model)
+        reader = stream.attach(False)
+        stream.open(factory)
+        return reader
+    key = single_flight_key(api_key, model, messages, temperature, max_tokens, base_url)
+    return get_single_flight().stream(key, model, factory)
+
+GENERATION_DEADLINE = float(os.environ.get("GROQ_DEADLINE", "60"))
+
+def _parse_deadlines(spec: str) -> Dict[str, float]:
+    """{"model-id": seconds} from "model-id=seconds,..." """
+    deadlines = {}
+    for item in spec.split(","):
+        model, _, seconds = item.partition("=")
+        if model.strip() and seconds.strip():
+            deadlines[model.strip()] = float(seconds)
+    return deadlines
+
+# Per-model overrides of GROQ_DEADLINE, e.g. "llama3-70b-8192=90,gemma-7b-it=30"
+MODEL_DEADLINES = _parse_deadlines(os.environ.get("GROQ_MODEL_DEADLINES", ""))
+
+def get_model_deadline(model: str) -> float:
+    """Hard limit in seconds on one generation with this model"""
+    return MODEL_DEADLINES.get(model, GENERATION_DEADLINE)
+
+def _fallback_status(error: Exception) -> Optional[str]:
+    """Status worth trying another model for: a 429, a 5xx or a network failure"""
+    if isinstance(error, GroqAPIError):
+        if error.status_code == 429 or error.status_code >= 500:
+            return str(error.status_code)
+        return None
+    if isinstance(error, requests.exceptions.RequestException):
+        return "network_error"
+    return None
+
+class _Race:
+    """A request and its hedge; the first to produce output wins and the other is closed"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.winner: Optional[str] = None
+        self.running = 0
+        self.finished: set = set()
+        self.errors: Dict[str, Exception] = {}
+        self.readers: Dict[str, StreamReader] = {}
+
+    def enter(self, contend, model: str, rate_limit_retries: Optional[int], role: str):
+        """Run a contender on its own thread, in the caller's context so it joins the trace"""
+        with self.cond:
+            self.running += 1
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(self._run, contend, model, rate_limit_retries, role),
+            name=f"generation-{role}", daemon=True
+        ).start()
+
+    def _run(self, contend, model: str, rate_limit_retries: Optional[int], role: str):
+        try:
+            contend(model, rate_limit_retries, self, role)
+        except Exception as e:
+            with self.cond:
+                self.errors[role] = e
+        finally:
+            with self.cond:
+                self.running -= 1
+                self.finished.add(role)
+                self.cond.notify_all()
+
+    def register(self, role: str, reader: StreamReader) -> bool:
+        """Track a contender's stream so a winner can close it; False if it has already lost"""
+        with self.cond:
+            self.readers[role] = reader
+            return self.winner is None or self.winner == role
+
+    def claim(self, role: str) -> bool:
+        """True if role won (now or earlier); the first claim closes the other contender"""
+        with self.cond:
+            if self.winner is None:
+                self.winner = role
+                self.cond.notify_all()
+            won = self.winner == role
+            losers = [reader for other, reader in self.readers.items() if other != self.winner]
+        if won:
+            for reader in losers:
+                reader.close()
+        return won
+
+    def decided(self) -> bool:
+        """Someone answered, or every contender so far has given up"""
+        return self.winner is not None or self.running == 0
+
+    def settled(self) -> bool:
+        """The winner is done (a loser may still be finishing a blocking call), or everyone is"""
+        return self.winner in self.finished or self.running == 0
+
+class Generation:
+    """A completion running on a background thread, so the caller can stop it"""
+
+    def __init__(self, api_key: str, messages, model: str, temperature: float, max_tokens: int,
+                 stream: bool = True, deadline: Optional[float] = None,
+                 session: Optional[requests.Session] = None, client: str = "default",
+                 base_url: Optional[str] = None, fallbacks: Sequence[str] = (), hedge: bool = False):
+        self.model = model
+        self.models = [model, *fallbacks]
+        self.attempts: List[Tuple[str, str]] = []  # (model, status) of each model fallen back from
+        self.hedge = hedge
+        self.hedged: Optional[str] = None  # model the duplicate went to, if one was sent
+        self.hedge_won = False
+        self.stream = stream
+        self.deadline = deadline
+        self.status = "running"  # then "ok", "cancelled", "timeout" or "error"
+        self.result: Optional[Dict] = None
+        self.error: Optional[Exception] = None
+        self.start_time = time.time()
+        self.end_time = None
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+        self._parts: List[str] = []
+        self._readers: List[StreamReader] = []
+        self._lock = threading.Lock()
+        if session is None and fallbacks:
+            # Let a 5xx reach the fallback at once rather than after urllib3's retries and backoff
+            session = get_http_session(retry_status=False)
+        self._request = (api_key, messages, temperature, max_tokens, session, client, base_url)
+        self._timer = None
+        if deadline:
+            self._timer = threading.Timer(deadline, self.cancel, ("timeout",))
+            self._timer.daemon = True
+            self._timer.start()
+        # The worker runs in a copy of the caller's context so its spans join the caller's trace
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._run,), name="generation", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end_time or time.time()) - self.start_time
+
+    def _run(self):
+        for index, model in enumerate(self.models):
+            last = index == len(self.models) - 1
+            self.model = model
+            try:
+                # Don't sit out a 429 backoff when another model can take the prompt
+                self._generate(model, None if last else 0)
+                return
+            except Exception as e:
+                status = _fallback_status(e)
+                if last or status is None or self._parts or self.cancel_event.is_set():
+                    self._end("error", error=e)
+                    return
+                self.attempts.append((model, status))
+
+    def _generate(self, model: str, rate_limit_retries: Optional[int]):
+        if not self.hedge:
+            self._contend(model, rate_limit_retries)
+            return
+        hedger = get_hedger()
+        hedger.earn()
+        index = self.models.index(model)
+        hedge_model = self.models[index + 1] if index + 1 < len(self.models) else model
+        race = _Race()
+        race.enter(self._contend, model, rate_limit_retries, "primary")
+        with race.cond:
+            race.cond.wait_for(race.decided, hedger.delay(model, "ttft" if self.stream else "latency"))
+            if not race.decided() and not self.cancel_event.is_set() and hedger.acquire():
+                self.hedged = hedge_model
+                # No 429 backoff and no joining the primary's single flight: it has to be a fresh request
+                race.enter(self._contend, hedge_model, 0, "hedge")
+            race.cond.wait_for(race.settled)
+        error = race.errors.get(race.winner) if race.winner else race.errors.get("primary", race.errors.get("hedge"))
+        if error is not None:
+            raise error
+
+    def _contend(self, model: str, rate_limit_retries: Optional[int], race: Optional[_Race] = None,
+                 role: str = "primary"):
+        """One request for this generation; in a race, only the first to answer writes the reply"""
+        api_key, messages, temperature, max_tokens, session, client, base_url = self._request
+        deduplicate = role == "primary"
+        if not self.stream:
+            result = request_completion(api_key, messages, model, temperature, max_tokens, session, client, base_url,
+                                        rate_limit_retries, deduplicate)
+            # A reply that lands after a cancel or the deadline is dropped, so a stopped text stays put
+            if self._claim(race, role, model) and self._append(result["content"]):
+                self._end("ok", result)
+            return
+        reader = open_stream(api_key, messages, model, temperature, max_tokens, session, client, base_url,
+                             rate_limit_retries, deduplicate)
+        self._readers.append(reader)
+        if self.cancel_event.is_set() or (race is not None and not race.register(role, reader)):
+            reader.close()  # cancelled or beaten while the request was being sent
+            return
+        won = race is None
+        for delta in reader:
+            if not won:
+                won = self._claim(race, role, model)
+            if not won or self.cancel_event.is_set() or not self._append(delta):
+                break
+        else:
+            if not (won or self._claim(race, role, model)):
+                return
+            self._end("ok", {
+                "model": model,
+                "content": reader.content,
+                "usage": reader.usage,
+                "latency": reader.latency,
+                "ttft": reader.ttft,
+                "generation_time": reader.generation_time
+            })
+
+    def _claim(self, race: Optional[_Race], role: str, model: str) -> bool:
+        """Whether this contender gets to write the reply; the winner's model becomes the one that answered"""
+        if race is None:
+            return True
+        if not race.claim(role):
+            return False
+        self.model = model
+        if role == "hedge":
+            self.hedge_won = True
+            LLM_HEDGES.inc(event="won")
+        return True
+
+    def _append(self, text: str) -> bool:
+        """Add to the reply unless the generation has already been settled"""
+        with self._lock:
+            if self.status != "running":
+                return False
+            self._parts.append(text)
+            return True
+
+    def _end(self, status: str, result: Optional[Dict] = None, error: Optional[Exception] = None) -> bool:
+        """Settle the outcome; only the first call wins, so a late worker can't overwrite a cancel"""
+        with self._lock:
+            if self.status != "running":
+                return False
+            self.status = status
+            self.result = result
+            self.error = error
+            self.end_time = time.time()
+        if self._timer is not None:
+            self._timer.cancel()
+        if status in ("cancelled", "timeout"):
+            LLM_STOPPED.inc(reason=status)
+        self.done.set()
+        return True
+
+    def cancel(self, reason: str = "cancelled"):
+        """Stop now and keep the partial text; the worker exits at its next check"""
+        self.cancel_event.set()
+        if not self._end(reason):
+            return
+        for reader in list(self._readers):
+            reader.close()
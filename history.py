@@ -0,0 +1,101 @@
+"""Compact in-memory chat history with a byte budget.
+
+Kept out of app.py so the classes keep their identity across reruns.
+"""
+import sys
+import datetime
+import threading
+import weakref
+from typing import Dict, List
+
+def format_clock(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')
+
+class ChatMessage:
+    """One chat message in compact form, readable like the dict it replaces"""
+
+    __slots__ = ("role", "content", "seq", "created")
+
+    _KEYS = ("role", "content", "seq", "time")
+
+    def __init__(self, role: str, content: str, seq: int, created: float):
+        self.role = sys.intern(role)
+        self.content = content
+        self.seq = seq
+        self.created = created
+
+    def __getitem__(self, key: str):
+        if key == "time":
+            return format_clock(self.created)
+        if key in self._KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._KEYS
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self._KEYS else default
+
+# Record, seq int and timestamp float, plus the list slot pointing at the record
+_RECORD_BYTES = sys.getsizeof(ChatMessage("user", "", 0, 0.0)) + sys.getsizeof(2 ** 20) + sys.getsizeof(0.0) + 8
+
+def message_bytes(message) -> int:
+    """Approximate memory held by one message, text included"""
+    if isinstance(message, ChatMessage):
+        return _RECORD_BYTES + sys.getsizeof(message.content)
+    return sys.getsizeof(message) + sum(sys.getsizeof(value) for value in message.values()) + 8
+
+class MessageHistory(list):
+    """A browser session's in-memory messages, with a running size in bytes"""
+
+    def __init__(self, messages=()):
+        super().__init__(messages)
+        self.nbytes = sum(map(message_bytes, self))
+
+    def add(self, message):
+        self.append(message)
+        self.nbytes += message_bytes(message)
+
+    def prepend(self, messages: List):
+        self[:0] = messages
+        self.nbytes += sum(map(message_bytes, messages))
+
+    @property
+    def on_disk(self) -> int:
+        """Older messages of the conversation that are only in the store"""
+        return (self[0].get("seq") or 0) if self else 0
+
+    def spill(self, budget: int, keep_last: int) -> int:
+        """Drop the oldest records until within budget, never the newest keep_last; returns how many"""
+        count = 0
+        freed = 0
+        limit = len(self) - keep_last
+        while count < limit and self.nbytes - freed > budget:
+            freed += message_bytes(self[count])
+            count += 1
+        if count:
+            del self[:count]
+            self.nbytes -= freed
+        return count
+
+class SessionMemoryRegistry:
+    """The live MessageHistory of every browser session in this process, held weakly"""
+
+    def __init__(self):
+        self._histories = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, client_id: str, history: MessageHistory):
+        with self._lock:
+            self._histories[client_id] = history
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            histories = list(self._histories.values())
+        return {
+            "sessions": len(histories),
+            "bytes": sum(history.nbytes for history in histories),
+            "messages": sum(len(history) for history in histories),
+            "on_disk": sum(history.on_disk for history in histories)
+        }
@@ -0,0 +1,355 @@
+"""Process-wide metrics in the Prometheus text format, shared by every session, thread and batch job.
+
+    METRICS_PORT=9464 streamlit run app.py          # curl localhost:9464/metrics
+    METRICS_FILE=/var/lib/node_exporter/groq_chat.prom streamlit run app.py
+"""
+import os
+import math
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_DUMP_INTERVAL = float(os.environ.get("METRICS_DUMP_INTERVAL", "15"))
+RATE_WINDOW_SECONDS = 60
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, ...]
+
+class _ShardedMetric:
+    """Per-thread shards of {label values: state}, merged on read"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, Dict]] = []
+        self._retired: Dict = {}
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _merge(self, into: Dict, shard: Dict):
+        raise NotImplementedError
+
+    def collect(self) -> Dict:
+        """Totals per label set across every shard"""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    # A finished thread can't write again, so its shard is final
+                    self._merge(self._retired, shard)
+            self._shards = live
+            totals: Dict = {}
+            self._merge(totals, self._retired)
+            for _, shard in live:
+                # dict() copies in one step under the GIL, so a concurrent insert can't break iteration
+                self._merge(totals, dict(shard))
+        return totals
+
+class Counter(_ShardedMetric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+    def _merge(self, into: Dict, shard: Dict):
+        for key, value in shard.items():
+            into[key] = into.get(key, 0.0) + value
+
+    def total(self, **labels) -> float:
+        """Sum over every label set matching the given labels"""
+        wanted = {self.labelnames.index(name): str(value) for name, value in labels.items()}
+        return sum(
+            value for key, value in self.collect().items()
+            if all(key[i] == v for i, v in wanted.items())
+        )
+
+class Gauge(Counter):
+    """Up/down value such as requests in flight"""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_ShardedMetric):
+    """Cumulative-bucket histogram; state per label set is [bucket counts..., sum, count]"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            state = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            shard[key] = state
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        state[index] += 1  # the slot past the last bucket is +Inf
+        state[-2] += value
+        state[-1] += 1
+
+    def _merge(self, into: Dict, shard: Dict):
+        for key, state in shard.items():
+            merged = into.get(key)
+            if merged is None:
+                into[key] = list(state)
+            else:
+                for i, value in enumerate(state):
+                    merged[i] += value
+
+    def quantile(self, state: List, q: float) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside its bucket, as histogram_quantile does"""
+        count = state[-1]
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for index, bound in enumerate(self.buckets + (math.inf,)):
+            in_bucket = state[index]
+            if cumulative + in_bucket >= rank and in_bucket:
+                if math.isinf(bound):
+                    return lower  # can't interpolate into +Inf; report the highest finite bound
+                return lower + (bound - lower) * (rank - cumulative) / in_bucket
+            cumulative += in_bucket
+            if not math.isinf(bound):
+                lower = bound
+        return lower
+
+class RateMeter:
+    """Events per second over a sliding window of one-second slots"""
+
+    def __init__(self, window: int = RATE_WINDOW_SECONDS):
+        self.window = window
+        self._slots = [0] * window
+        self._stamps = [0] * window
+        self._lock = threading.Lock()
+
+    def mark(self, amount: int = 1):
+        second = int(time.time())
+        index = second % self.window
+        with self._lock:
+            if self._stamps[index] != second:
+                self._stamps[index] = second
+                self._slots[index] = 0
+            self._slots[index] += amount
+
+    def rate(self) -> float:
+        now = int(time.time())
+        with self._lock:
+            events = sum(
+                count for count, stamp in zip(self._slots, self._stamps)
+                if now - self.window < stamp <= now
+            )
+        return events / self.window
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames: Tuple[str, ...], key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_ShardedMetric] = []
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def register(self, metric: _ShardedMetric) -> _ShardedMetric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, state in sorted(metric.collect().items()):
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (math.inf,), state):
+                        cumulative += count
+                        labels = _format_labels(metric.labelnames, key, ("le", _format_value(bound)))
+                        lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+                    labels = _format_labels(metric.labelnames, key)
+                    lines.append(f"{metric.name}_sum{labels} {_format_value(state[-2])}")
+                    lines.append(f"{metric.name}_count{labels} {state[-1]}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(state)}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: str):
+        """Atomically replace path with the current exposition"""
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(temp_path, path)
+
+REGISTRY = MetricsRegistry()
+
+# Fed by groq_client for every API call, from the app, comparison workers and batch jobs alike
+LLM_REQUESTS = REGISTRY.counter("llm_requests_total", "Chat completion requests by outcome", ("model", "status"))
+LLM_LATENCY = REGISTRY.histogram("llm_request_duration_seconds", "Completion wall time", ("model",))
+LLM_TTFT = REGISTRY.histogram("llm_time_to_first_token_seconds", "Time to the first streamed token", ("model",))
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "Tokens billed by the API", ("model", "kind"))
+LLM_INFLIGHT = REGISTRY.gauge("llm_requests_in_flight", "Requests sent and not yet finished")
+LLM_THROTTLED = REGISTRY.counter("llm_rate_limited_total", "429 responses absorbed by the client rate limiter")
+LLM_STOPPED = REGISTRY.counter("llm_generations_stopped_total", "Generations cancelled or cut off by their deadline",
+                               ("reason",))
+LLM_DEDUPLICATED = REGISTRY.counter("llm_deduplicated_total", "Calls that joined an identical request in flight",
+                                    ("mode",))
+LLM_HEDGES = REGISTRY.counter("llm_hedged_requests_total",
+                              "Duplicate requests for slow responses: fired, won the race, or denied by the budget",
+                              ("event",))
+# Fed by the app
+CACHE_LOOKUPS = REGISTRY.counter("app_cache_lookups_total", "Response cache lookups", ("result",))
+SESSIONS_STARTED = REGISTRY.counter("app_sessions_started_total", "Browser sessions opened")
+
+REQUEST_RATE = RateMeter()
+
+def observe_request(model: str, status: str, latency: Optional[float] = None, usage: Optional[Dict] = None,
+                    ttft: Optional[float] = None):
+    """Record one finished API call"""
+    LLM_REQUESTS.inc(model=model, status=status)
+    REQUEST_RATE.mark()
+    if latency is not None:
+        LLM_LATENCY.observe(latency, model=model)
+    if ttft is not None:
+        LLM_TTFT.observe(ttft, model=model)
+    if usage:
+        LLM_TOKENS.inc(usage.get("prompt_tokens", 0), model=model, kind="prompt")
+        LLM_TOKENS.inc(usage.get("completion_tokens", 0), model=model, kind="completion")
+
+def summary() -> Dict:
+    """Headline numbers and per-model latency percentiles for dashboards"""
+    requests_by_model: Dict[str, Dict[str, float]] = {}
+    for (model, status), count in LLM_REQUESTS.collect().items():
+        entry = requests_by_model.setdefault(model, {"requests": 0, "errors": 0})
+        entry["requests"] += count
+        if status != "ok":
+            entry["errors"] += count
+    models = {}
+    for (model,), state in LLM_LATENCY.collect().items():
+        models[model] = {
+            **requests_by_model.get(model, {"requests": 0, "errors": 0}),
+            "p50": LLM_LATENCY.quantile(state, 0.50),
+            "p95": LLM_LATENCY.quantile(state, 0.95),
+            "p99": LLM_LATENCY.quantile(state, 0.99),
+            "mean": state[-2] / state[-1] if state[-1] else None
+        }
+    for model, entry in requests_by_model.items():
+        models.setdefault(model, {**entry, "p50": None, "p95": None, "p99": None, "mean": None})
+    return {
+        "qps": REQUEST_RATE.rate(),
+        "requests": LLM_REQUESTS.total(),
+        "errors": sum(m["errors"] for m in requests_by_model.values()),
+        "tokens": LLM_TOKENS.total(),
+        "in_flight": LLM_INFLIGHT.total(),
+        "throttled": LLM_THROTTLED.total(),
+        "deduplicated": LLM_DEDUPLICATED.total(),
+        "stopped": LLM_STOPPED.total(),
+        "hedges": {event: count for (event,), count in LLM_HEDGES.collect().items()},
+        "sessions": SESSIONS_STARTED.total(),
+        "uptime": time.time() - REGISTRY.started,
+        "models": models
+    }
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+def _dump_forever(path: str, interval: float):
+    while True:
+        try:
+            REGISTRY.write_file(path)
+        except OSError:
+            pass  # an unwritable path shouldn't take the app down; the next dump retries
+        time.sleep(interval)
+
+def start_exporters():
+    """Start the /metrics endpoint and the file dump configured in the environment, once per process"""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        if METRICS_PORT:
+            try:
+                server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), _MetricsHandler)
+            except OSError:
+                server = None  # another process (or a previous server) already holds the port
+            if server is not None:
+                server.daemon_threads = True
+                threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        if METRICS_FILE:
+            threading.Thread(
+                target=_dump_forever, args=(METRICS_FILE, METRICS_DUMP_INTERVAL), name="metrics-file", daemon=True
+            ).start()
@@ -0,0 +1,287 @@
+"""Local OpenAI-compatible chat completions server for offline and load testing.
+
+    python mock_server.py --port 8400 --latency 0.2 --tokens-per-second 300
+    MOCK_LLM_URL=http://127.0.0.1:8400/v1 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from groq_client import get_model_info
+
+MOCK_VOCABULARY = (
+    "neural lattice signal vector stream token latency inference cache matrix "
+    "quantum packet relay circuit photon kernel tensor gradient epoch shard "
+    "the a of to and in is that for with on as by it at from this which"
+).split()
+
+class MockConfig:
+    """Behaviour knobs for the mock server"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, tokens_per_second: float = 0.0,
+                 response_tokens: int = 64, error_rate: float = 0.0, error_status: int = 500,
+                 retry_after: float = 1.0, tokens_per_minute: int = 0, seed: int = 0):
+        self.latency = latency  # seconds before the first byte, like queue + prompt time
+        self.jitter = jitter  # uniform +/- spread around latency
+        self.tokens_per_second = tokens_per_second  # 0 generates instantly
+        self.response_tokens = response_tokens  # reply length, capped by max_tokens
+        self.error_rate = error_rate  # share of requests answered with error_status
+        self.error_status = error_status
+        self.retry_after = retry_after  # sent with injected 429s
+        self.tokens_per_minute = tokens_per_minute  # emulate Groq's TPM limit and headers when > 0
+        self.seed = seed
+
+class MockLLMServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the config and request counters"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8400, config: Optional[MockConfig] = None):
+        super().__init__((host, port), _MockHandler)
+        self.config = config or MockConfig()
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.config.seed)
+        self._window_start = time.monotonic()
+        self._window_tokens = 0
+        self._thread = None
+        self.stats = {"requests": 0, "streamed": 0, "errors_injected": 0, "rate_limited": 0, "completion_tokens": 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        """Serve on a daemon thread; returns self for chaining"""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.config.error_rate
+
+    def draw_latency(self) -> float:
+        with self._lock:
+            return max(0.0, self.config.latency + self._rng.uniform(-self.config.jitter, self.config.jitter))
+
+    def charge_tokens(self, tokens: int) -> Tuple[bool, Dict[str, str]]:
+        """Debit the emulated per-minute token budget; returns (allowed, Groq-style headers)"""
+        limit = self.config.tokens_per_minute
+        if not limit:
+            return True, {}
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 60:
+                self._window_start = now
+                self._window_tokens = 0
+            allowed = self._window_tokens + tokens <= limit
+            if allowed:
+                self._window_tokens += tokens
+            reset = 60 - (now - self._window_start)
+            headers = {
+                "x-ratelimit-limit-tokens": str(limit),
+                "x-ratelimit-remaining-tokens": str(max(0, limit - self._window_tokens)),
+                "x-ratelimit-reset-tokens": f"{reset:.2f}s"
+            }
+            if not allowed:
+                headers["retry-after"] = str(max(1, round(reset)))
+        return allowed, headers
+
+def _count_prompt_tokens(messages: List[Dict]) -> int:
+    """Same four-characters-per-token rule the client uses for budgeting"""
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4 + 4 * len(messages)
+
+def _reply_words(messages: List[Dict], length: int, seed: int) -> List[str]:
+    """Deterministic filler text for a conversation"""
+    prompt = messages[-1].get("content", "") if messages else ""
+    digest = hashlib.sha256(f"{seed}:{prompt}".encode("utf-8")).digest()
+    rng = random.Random(int.from_bytes(digest[:8], "big"))
+    return [rng.choice(MOCK_VOCABULARY) for _ in range(length)]
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/v1/models", "/models"):
+            models = [{"id": info["id"], "object": "model", "owned_by": "mock"} for info in get_model_info().values()]
+            self._send_json(200, {"object": "list", "data": models})
+        elif self.path == "/health":
+            self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_error(404, "not found", "invalid_request_error")
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_error(404, "not found", "invalid_request_error")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            messages = body["messages"]
+        except (ValueError, KeyError):
+            self._send_error(400, "request body must be JSON with a messages list", "invalid_request_error")
+            return
+
+        server = self.server
+        config = server.config
+        server.count("requests")
+
+        if server.should_fail():
+            server.count("errors_injected")
+            headers = {"retry-after": str(config.retry_after)} if config.error_status == 429 else {}
+            self._send_error(config.error_status, "injected failure", "mock_error", headers)
+            return
+
+        prompt_tokens = _count_prompt_tokens(messages)
+        completion_tokens = max(0, min(config.response_tokens, int(body.get("max_tokens") or config.response_tokens)))
+        allowed, limit_headers = server.charge_tokens(prompt_tokens + completion_tokens)
+        if not allowed:
+            server.count("rate_limited")
+            self._send_error(429, "rate limit reached for tokens per minute", "tokens", limit_headers)
+            return
+
+        words = _reply_words(messages, completion_tokens, config.seed)
+        prompt_time = server.draw_latency()
+        completion_time = completion_tokens / config.tokens_per_second if config.tokens_per_second else 0.0
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "queue_time": 0.0,
+            "prompt_time": round(prompt_time, 6),
+            "completion_time": round(completion_time, 6),
+            "total_time": round(prompt_time + completion_time, 6)
+        }
+        server.count("completion_tokens", completion_tokens)
+
+        time.sleep(prompt_time)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = body.get("model", "mock")
+        if body.get("stream"):
+            server.count("streamed")
+            self._stream(completion_id, model, words, usage, limit_headers)
+        else:
+            time.sleep(completion_time)
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            }, limit_headers)
+
+    def _stream(self, completion_id: str, model: str, words: List[str], usage: Dict, headers: Dict[str, str]):
+        """Server-sent events, one word per chunk, paced to tokens_per_second"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def chunk(delta: Dict, finish_reason: Optional[str] = None, extra: Optional[Dict] = None) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            payload.update(extra or {})
+            return b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n"
+
+        rate = self.server.config.tokens_per_second
+        start = time.monotonic()
+        try:
+            self._write_chunk(chunk({"role": "assistant", "content": ""}))
+            for i, word in enumerate(words):
+                if rate:
+                    # Pace against the start time so sleep overshoot doesn't accumulate
+                    delay = start + (i + 1) / rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                self._write_chunk(chunk({"content": word if i == 0 else " " + word}))
+            self._write_chunk(chunk({}, "stop", {"x_groq": {"id": completion_id, "usage": usage}}))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # client hung up mid-stream
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, error_type: str, headers: Optional[Dict[str, str]] = None):
+        self._send_json(status, {"error": {"message": message, "type": error_type}}, headers)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8400)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- seconds around --latency")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="generation speed (0 = instant)")
+    parser.add_argument("--response-tokens", type=int, default=64, help="reply length, capped by max_tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected failures")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on injected 429s")
+    parser.add_argument("--tpm", type=int, default=0, help="emulated tokens-per-minute limit (0 = none)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        tokens_per_minute=args.tpm,
+        seed=args.seed
+    )
+    server = MockLLMServer(args.host, args.port, config)
+    print(f"mock LLM server on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
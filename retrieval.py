@@ -0,0 +1,150 @@
+"""Local vector index over a conversation's turns, for recalling relevant older context"""
+import re
+import zlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+
+# Too common to say anything about what a turn is about
+STOPWORDS = frozenset(
+    "a an and are as at be but by can could did do does for from had has have how i if in into is it its me my "
+    "no not of on or our so than that the their them then there these they this to was we were what when where "
+    "which who why will with would you your".split()
+)
+
+class HashingEmbedder:
+    """Text to unit-length float32 vectors of hashed word unigrams and bigrams"""
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        # Stored next to each vector; rows embedded differently are re-embedded on load
+        self.name = f"hash-ngram-v1-{dimensions}"
+
+    def _buckets(self, text: str) -> List[int]:
+        words = [w for w in _WORD_RE.findall(text.lower()) if w not in STOPWORDS]
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return [zlib.crc32(feature.encode("utf-8")) for feature in features]
+
+    def embed_many(self, texts: Sequence[str]) -> "np.ndarray":
+        """One row per text; a text with no usable words gets a zero row"""
+        import numpy as np
+
+        rows, hashes = [], []
+        for row, text in enumerate(texts):
+            buckets = self._buckets(text)
+            rows.extend([row] * len(buckets))
+            hashes.extend(buckets)
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        # Low bits pick the bucket, the top bit the sign, so collisions tend to cancel
+        signs = np.where(hashes >> 31, 1.0, -1.0).astype(np.float32)
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.intp), hashes % self.dimensions), signs)
+        np.copysign(np.log1p(np.abs(matrix)), matrix, out=matrix)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    def embed(self, text: str) -> "np.ndarray":
+        return self.embed_many([text])[0]
+
+class VectorIndex:
+    """One conversation's turn vectors, searchable by cosine similarity"""
+
+    def __init__(self, dimensions: int, capacity: int = 256):
+        self.dimensions = dimensions
+        self.size = 0
+        self._capacity = capacity
+        self._matrix = None
+        self._seqs = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        if self._matrix is None:
+            return 0
+        return self._matrix.nbytes + self._seqs.nbytes
+
+    def add(self, seqs: Sequence[int], vectors: "np.ndarray"):
+        """Append rows for the given message sequence numbers"""
+        import numpy as np
+
+        count = len(seqs)
+        if not count:
+            return
+        with self._lock:
+            needed = self.size + count
+            if self._matrix is None or needed > len(self._seqs):
+                capacity = max(self._capacity, len(self._seqs) if self._seqs is not None else 0)
+                while capacity < needed:
+                    capacity *= 2
+                matrix = np.zeros((capacity, self.dimensions), dtype=np.float32)
+                seq_column = np.empty(capacity, dtype=np.int64)
+                if self._matrix is not None:
+                    matrix[:self.size] = self._matrix[:self.size]
+                    seq_column[:self.size] = self._seqs[:self.size]
+                self._matrix, self._seqs = matrix, seq_column
+            self._matrix[self.size:needed] = vectors
+            self._seqs[self.size:needed] = seqs
+            self.size = needed
+
+    def search(self, query: "np.ndarray", k: int, before_seq: Optional[int] = None,
+               min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """The k best (seq, score) pairs, best first, among turns before before_seq"""
+        import numpy as np
+
+        with self._lock:
+            if not self.size or k <= 0:
+                return []
+            scores = self._matrix[:self.size] @ query
+            if before_seq is not None:
+                scores[self._seqs[:self.size] >= before_seq] = -np.inf
+            k = min(k, self.size)
+            top = np.argpartition(scores, self.size - k)[self.size - k:]
+            top = top[np.argsort(scores[top])[::-1]]
+            return [(int(self._seqs[i]), float(scores[i])) for i in top if scores[i] >= min_score]
+
+class IndexCache:
+    """In-memory VectorIndexes of the most recently used conversations"""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, VectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, load: Callable[[], VectorIndex]) -> VectorIndex:
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None:
+                self._entries.move_to_end(key)
+                return index
+        # Load outside the lock; two sessions racing on a cold key just build it twice
+        index = load()
+        with self._lock:
+            index = self._entries.setdefault(key, index)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def peek(self, key: str) -> Optional[VectorIndex]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def nbytes(self, keys: Optional[Iterable[str]] = None) -> int:
+        with self._lock:
+            indexes = list(self._entries.values()) if keys is None else [
+                self._entries[key] for key in keys if key in self._entries
+            ]
+        return sum(index.nbytes for index in indexes)
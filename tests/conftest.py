@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import MockConfig, MockLLMServer  # noqa: E402
+
+@pytest.fixture
+def mock_llm():
+    """In-process mock API on a free port; tests adjust server.config as they go"""
+    server = MockLLMServer(port=0, config=MockConfig()).start()
+    yield server
+    server.stop()
@@ -0,0 +1,56 @@
+import time
+
+import groq_client as gc
+
+MODEL = "llama3-8b-8192"
+
+def generation(server, prompt: str, **kwargs) -> gc.Generation:
+    return gc.Generation("local", [{"role": "user", "content": prompt}], MODEL, 0.0, 256,
+                         base_url=server.base_url, **kwargs)
+
+def test_cancel_keeps_streamed_text(mock_llm):
+    mock_llm.config.tokens_per_second = 40
+    mock_llm.config.response_tokens = 200
+    g = generation(mock_llm, "cancel a stream")
+    time.sleep(0.5)
+    g.cancel()
+    assert g.status == "cancelled" and g.done.is_set()
+    partial = g.text
+    assert partial
+    time.sleep(0.3)
+    assert g.text == partial
+    g._thread.join(1)
+    assert not g._thread.is_alive()
+
+def test_cancel_drops_a_late_blocking_result(mock_llm):
+    mock_llm.config.latency = 0.4
+    g = generation(mock_llm, "cancel a blocking call", stream=False)
+    time.sleep(0.1)
+    g.cancel()
+    g._thread.join(2)
+    assert g.status == "cancelled"
+    assert g.text == "" and g.result is None
+
+def test_deadline_keeps_streamed_text(mock_llm):
+    mock_llm.config.tokens_per_second = 40
+    mock_llm.config.response_tokens = 200
+    g = generation(mock_llm, "stream past the deadline", deadline=0.5)
+    assert g.done.wait(2)
+    assert g.status == "timeout"
+    partial = g.text
+    assert partial
+    time.sleep(0.3)
+    assert g.text == partial
+
+def test_deadline_drops_a_late_blocking_result(mock_llm):
+    mock_llm.config.latency = 0.4
+    g = generation(mock_llm, "blocking past the deadline", stream=False, deadline=0.1)
+    assert g.done.wait(2)
+    g._thread.join(2)
+    assert g.status == "timeout" and g.text == ""
+
+def test_completed_generation_is_not_changed_by_cancel(mock_llm):
+    g = generation(mock_llm, "finish first")
+    assert g.done.wait(5)
+    g.cancel()
+    assert g.status == "ok" and g.text == g.result["content"]
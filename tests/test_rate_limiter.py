@@ -0,0 +1,55 @@
+import threading
+import time
+
+import groq_client as gc
+
+def wait_for_depth(limiter: gc.RateLimiter, depth: int):
+    deadline = time.monotonic() + 2
+    while limiter.stats()["queue_depth"] < depth:
+        assert time.monotonic() < deadline, "waiter never queued"
+        time.sleep(0.005)
+
+def queue_waiters(limiter: gc.RateLimiter, clients):
+    """Queue one acquire per entry, in order, while the limiter is paused; returns queue positions in grant order"""
+    granted = []
+    lock = threading.Lock()
+
+    def acquire(position, client):
+        limiter.acquire(client=client)
+        with lock:
+            granted.append(position)
+
+    limiter.backoff(retry_after=0.3)
+    threads = []
+    for position, client in enumerate(clients):
+        thread = threading.Thread(target=acquire, args=(position, client))
+        thread.start()
+        threads.append(thread)
+        wait_for_depth(limiter, position + 1)
+    for thread in threads:
+        thread.join(5)
+    return granted
+
+def test_backlogged_client_does_not_starve_another():
+    limiter = gc.RateLimiter(requests_per_minute=600)
+    granted = queue_waiters(limiter, ["batch"] * 4 + ["tab"])
+    # The tab queued last but is served after the batch's first request, not after its whole backlog
+    assert granted == [0, 4, 1, 2, 3]
+
+def test_clients_alternate_when_both_are_backlogged():
+    limiter = gc.RateLimiter(requests_per_minute=600)
+    granted = queue_waiters(limiter, ["a", "a", "a", "b", "b", "b"])
+    assert granted == [0, 3, 1, 4, 2, 5]
+
+def test_one_client_is_served_in_arrival_order():
+    limiter = gc.RateLimiter(requests_per_minute=600)
+    assert queue_waiters(limiter, ["tab"] * 4) == [0, 1, 2, 3]
+
+def test_limiters_are_kept_per_model(mock_llm):
+    first = gc.get_rate_limiter(mock_llm.base_url, "llama3-8b-8192")
+    assert gc.get_rate_limiter(mock_llm.base_url, "llama3-8b-8192") is first
+    other = gc.get_rate_limiter(mock_llm.base_url, "gemma-7b-it")
+    assert other is not first
+    first.backoff(retry_after=5)
+    assert other.stats()["blocked_for"] == 0
+    assert set(gc.get_rate_limiters(mock_llm.base_url)) == {"llama3-8b-8192", "gemma-7b-it"}
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+import groq_client as gc
+
+MODEL = "llama3-8b-8192"
+
+def run_together(target, count: int, stagger: float = 0.0):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join(10)
+
+def test_identical_blocking_requests_are_sent_once(mock_llm):
+    mock_llm.config.latency = 0.3
+    messages = [{"role": "user", "content": "blocking fan-out"}]
+    results = []
+    run_together(lambda: results.append(
+        gc.request_completion("local", messages, MODEL, 0.7, 64, base_url=mock_llm.base_url)
+    ), 5)
+    assert mock_llm.stats["requests"] == 1
+    assert len({result["content"] for result in results}) == 1
+    assert sum(bool(result.get("shared")) for result in results) == 4
+
+def test_late_stream_follower_gets_the_whole_reply(mock_llm):
+    mock_llm.config.tokens_per_second = 100
+    mock_llm.config.response_tokens = 40
+    messages = [{"role": "user", "content": "stream fan-out"}]
+    readers = []
+
+    def read():
+        reader = gc.open_stream("local", messages, MODEL, 0.7, 64, base_url=mock_llm.base_url)
+        text = "".join(reader)
+        readers.append((reader, text))
+
+    # Followers join a stream that has already sent part of its reply
+    run_together(read, 3, stagger=0.1)
+    assert mock_llm.stats["requests"] == 1
+    texts = {text for _, text in readers}
+    assert len(texts) == 1 and texts.pop()
+    assert sum(reader.shared for reader, _ in readers) == 2
+    assert all(reader.usage.get("total_tokens") for reader, _ in readers)
+
+def test_followers_get_the_leaders_error(mock_llm):
+    mock_llm.config.latency = 0.2
+    mock_llm.config.error_rate = 1.0
+    mock_llm.config.error_status = 400
+    messages = [{"role": "user", "content": "shared failure"}]
+    errors = []
+
+    def call():
+        with pytest.raises(gc.GroqAPIError) as caught:
+            gc.request_completion("local", messages, MODEL, 0.7, 64, base_url=mock_llm.base_url)
+        errors.append(caught.value.status_code)
+
+    run_together(call, 3)
+    assert errors == [400] * 3
+    assert mock_llm.stats["requests"] == 1
+
+def test_abandoned_stream_is_not_joined(mock_llm):
+    mock_llm.config.tokens_per_second = 100
+    messages = [{"role": "user", "content": "abandoned"}]
+    reader = gc.open_stream("local", messages, MODEL, 0.7, 64, base_url=mock_llm.base_url)
+    next(iter(reader))
+    reader.close()
+    assert gc.get_single_flight().stats()["in_flight"] == 0
+    reader = gc.open_stream("local", messages, MODEL, 0.7, 64, base_url=mock_llm.base_url)
+    assert not reader.shared and "".join(reader)
+    assert mock_llm.stats["requests"] == 2
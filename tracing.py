@@ -0,0 +1,264 @@
+"""Lightweight request tracing with optional OpenTelemetry (OTLP/JSON) export.
+
+    TRACE_EXPORT_PATH=traces.jsonl                           # one request per line
+    TRACE_OTLP_ENDPOINT=http://localhost:4318/v1/traces      # OTLP/HTTP collector
+"""
+import os
+import json
+import time
+import queue
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Dict, List
+
+import requests
+
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH", "")
+TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "ai-neural-interface")
+TRACE_EXPORT_QUEUE = 1000
+
+class Span:
+    """One timed phase; times are Unix epoch nanoseconds as OTLP expects"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    recording = True
+
+    def __init__(self, name: str, parent_id: Optional[str], start_ns: int, attributes: Dict):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = start_ns
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+class _NoopSpan:
+    """Stand-in yielded by span() outside a trace"""
+
+    __slots__ = ()
+
+    recording = False
+
+    def set(self, **attributes):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    """Spans of one unit of work, rooted at a span named after it"""
+
+    def __init__(self, name: str, **attributes):
+        self.trace_id = os.urandom(16).hex()
+        self.root = Span(name, None, time.time_ns(), attributes)
+        self.spans: List[Span] = [self.root]
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.root.name
+
+    def start_span(self, name: str, parent: Optional[Span] = None, start_ns: Optional[int] = None,
+                   **attributes) -> Span:
+        span = Span(name, (parent or self.root).span_id, start_ns or time.time_ns(), attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def add_span(self, name: str, duration: float, end_ns: Optional[int] = None, parent: Optional[Span] = None,
+                 **attributes) -> Span:
+        """Record a phase measured elsewhere (server-reported time, summed render time)"""
+        end_ns = end_ns or time.time_ns()
+        span = self.start_span(name, parent, end_ns - int(duration * 1e9), **attributes)
+        span.end_ns = end_ns
+        return span
+
+    def finish(self):
+        if self.root.end_ns is None:
+            self.root.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def phases(self) -> Dict[str, float]:
+        """Milliseconds per direct child of the root, summed when a phase repeats"""
+        phases: Dict[str, float] = {}
+        with self._lock:
+            children = [s for s in self.spans if s.parent_id == self.root.span_id]
+        for span in children:
+            phases[span.name] = phases.get(span.name, 0.0) + span.duration_ms
+        return phases
+
+    def to_otlp(self) -> Dict:
+        """OTLP/JSON ExportTraceServiceRequest holding this trace"""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": TRACE_SERVICE_NAME})},
+                "scopeSpans": [{
+                    "scope": {"name": "tracing"},
+                    "spans": [_otlp_span(self.trace_id, span) for span in spans]
+                }]
+            }]
+        }
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+def _otlp_span(trace_id: str, span: Span) -> Dict:
+    record = {
+        "traceId": trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 3 if span.name in ("http", "stream") else 1,  # CLIENT for network phases, else INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns or span.start_ns),
+        "attributes": _otlp_attributes(span.attributes),
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+    }
+    if span.parent_id:
+        record["parentSpanId"] = span.parent_id
+    return record
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Open a trace for the enclosed work and make it current"""
+    with use_trace(Trace(name, **attributes)) as trace:
+        try:
+            yield trace
+        except Exception as e:
+            trace.root.error = repr(e)
+            raise
+        finally:
+            trace.finish()
+
+@contextmanager
+def use_trace(trace: Trace):
+    """Make an existing trace current without finishing it, for work that spans several reruns"""
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a child of the current span, if a trace is active"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+    current = trace.start_span(name, _current_span.get(), **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+def record_server_timing(usage: Dict, trace: Optional[Trace] = None, end_ns: Optional[int] = None):
+    """Add the API's own timing (Groq's usage.*_time fields) as a "server" span"""
+    trace = trace or _current_trace.get()
+    if trace is None or not usage or not usage.get("total_time"):
+        return
+    trace.add_span(
+        "server",
+        usage["total_time"],
+        end_ns,
+        queue_ms=round(usage.get("queue_time", 0.0) * 1000, 3),
+        prompt_ms=round(usage.get("prompt_time", 0.0) * 1000, 3),
+        completion_ms=round(usage.get("completion_time", 0.0) * 1000, 3)
+    )
+
+class TraceExporter:
+    """Ships finished traces to a JSONL file and/or an OTLP/HTTP collector off the caller's thread"""
+
+    def __init__(self, path: str = "", endpoint: str = ""):
+        self.path = path
+        self.endpoint = endpoint
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=TRACE_EXPORT_QUEUE)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 10.0):
+        """Wait up to timeout seconds for queued traces to be shipped, before a short-lived process exits"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _run(self):
+        while True:
+            payload = self._queue.get().to_otlp()
+            try:
+                if self.path:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+                if self.endpoint:
+                    requests.post(self.endpoint, json=payload, timeout=10).raise_for_status()
+                self.exported += 1
+            except (OSError, requests.exceptions.RequestException):
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queued": self._queue.qsize()
+        }
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def get_trace_exporter() -> Optional[TraceExporter]:
+    """Process-wide exporter, or None when no export target is configured"""
+    global _exporter
+    if not (TRACE_EXPORT_PATH or TRACE_OTLP_ENDPOINT):
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = TraceExporter(TRACE_EXPORT_PATH, TRACE_OTLP_ENDPOINT)
+        return _exporter